@@ -1,14 +1,27 @@
 import abc
-import json
+import errno
 import datetime
 import logging
 import hashlib
+import hmac
+import time
 import uuid
 import re
+import random
+import os
+import signal
+import threading
+import Queue
 from optparse import OptionParser
 from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
-from scoring import get_score, get_interests
-from store import Store, RedisStore
+import scoring
+from scoring import get_score, get_scores, get_interests_many
+from store import Store, RedisStore, MemoryStore, ShardedStore, LocalCache, CachedStore, WriteBehindStore
+from store import CircuitBreaker, Deadline
+from codec import get_codec, NAMES as CODECS
+from logqueue import setup_logging
+from metrics import METRICS
+from profiling import Timings, TimedStore, Profiler, stage
 
 
 SALT = "Otus"
@@ -20,13 +33,21 @@ FORBIDDEN = 403
 NOT_FOUND = 404
 INVALID_REQUEST = 422
 INTERNAL_ERROR = 500
+GATEWAY_TIMEOUT = 504
 ERRORS = {
     BAD_REQUEST: "Bad Request in test",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
     INVALID_REQUEST: "Invalid Request",
     INTERNAL_ERROR: "Internal Server Error",
+    GATEWAY_TIMEOUT: "Gateway Timeout",
 }
+REQUESTS = METRICS.counter("scoring_requests_total", "Answered requests", ("method", "code"))
+REQUEST_LATENCY = METRICS.histogram(
+    "scoring_request_duration_seconds", "Time to read, answer and write a request", ("method",))
+IN_FLIGHT = METRICS.gauge("scoring_requests_in_flight", "Requests being answered")
+VALIDATION_ERRORS = METRICS.counter("scoring_validation_errors_total", "Invalid request fields", ("field",))
+AUTH_FAILURES = METRICS.counter("scoring_auth_failures_total", "Requests with an invalid token")
 UNKNOWN = 0
 MALE = 1
 FEMALE = 2
@@ -78,6 +99,8 @@ class Field(object):
 
 
 class CharField(Field):
+    inline_type = (basestring, 'The field must be of string type.')
+
     def valid_value(self, value):
         if not isinstance(value, basestring):
             raise ValidationError('The field must be of string type.')
@@ -85,6 +108,8 @@ class CharField(Field):
 
 
 class ArgumentsField(Field):
+    inline_type = (dict, 'The field must be a dictionary type.')
+
     def valid_value(self, value):
         if not isinstance(value, dict):
             raise ValidationError('The field must be a dictionary type.')
@@ -109,19 +134,70 @@ class PhoneField(Field):
         return value
 
 
+DATE_RE = re.compile(r'(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])\.(1[0-2]|0[1-9]|[1-9])\.(\d\d\d\d)\Z')
+DATE_MEMO = {}
+DATE_MEMO_SIZE = 10000
+DATE_MEMO_LENGTH = len("DD.MM.YYYY")
+
+
+def parse_date(value):
+    """Parses DD.MM.YYYY like `strptime(value, '%d.%m.%Y')` does.
+
+    Results of recently seen strings, invalid ones too, are memoized
+    if they are no longer than a date. Returns None if `value` is not a valid date.
+    """
+    if not isinstance(value, basestring):
+        return None
+    memoize = len(value) <= DATE_MEMO_LENGTH
+    date = DATE_MEMO.get(value) if memoize else None
+    if date is not None:
+        return date or None
+    date = False
+    match = DATE_RE.match(value)
+    if match:
+        day, month, year = match.groups()
+        try:
+            date = datetime.datetime(int(year), int(month), int(day))
+        except ValueError:
+            pass
+    if memoize:
+        if len(DATE_MEMO) >= DATE_MEMO_SIZE:
+            DATE_MEMO.clear()
+        DATE_MEMO[value] = date
+    return date or None
+
+
+class CurrentYear(object):
+    """Current year, looked up again only when the year changes."""
+
+    def __init__(self):
+        self.year, self.until = 0, 0
+
+    def get(self):
+        if time.time() >= self.until:
+            year = datetime.datetime.now().year
+            # The year is set first: a thread seeing the new `until`
+            # must not read the year before it.
+            self.year = year
+            self.until = time.mktime(datetime.datetime(year + 1, 1, 1).timetuple())
+        return self.year
+
+CURRENT_YEAR = CurrentYear()
+
+
 class DateField(Field):
     def valid_value(self, value):
-        try:
-            return datetime.datetime.strptime(value, '%d.%m.%Y')
-        except:
+        date = parse_date(value)
+        if date is None:
             raise ValidationError('Field has an invalid date format.')
+        return date
 
 
 class BirthDayField(DateField):
     def valid_value(self, value):
         value = super(BirthDayField, self).valid_value(value)
         limit_yars = 70
-        if (datetime.datetime.now().year - value.year) > limit_yars:
+        if (CURRENT_YEAR.get() - value.year) > limit_yars:
             raise ValidationError(
                 'Age can not be more than %s years.' % 
                 (limit_yars))
@@ -148,41 +224,94 @@ class ClientIDsField(Field):
 
 #***********************************************REQUEST*****************************************************************
 
+EMPTY_VALUES = ('', {}, [], None)
+
+
+def compile_validator(declared_defs):
+    """Builds `valid_required_field` for a request class.
+
+    The generated function checks the fields one after another the way
+    `Field.__set__` does and gives the same error messages, but without
+    descriptors and without raising on valid values. A field class that
+    defines `inline_type` gets its type check inlined.
+    """
+    namespace = {"ValidationError": ValidationError, "EMPTY_VALUES": EMPTY_VALUES}
+    lines = [
+        "def valid_required_field(self):",
+        "    get = self.arguments_fied.get",
+        "    errors = self.error_field",
+    ]
+    for name, field in declared_defs.items():
+        missing = ("errors[%r] = 'This field is required.'; self.%s = None" % (name, name)
+                   if field.required else "self.%s = None" % name)
+        lines += [
+            "    value = get(%r)" % name,
+            "    if value is None:",
+            "        %s" % missing,
+        ]
+        if not field.nullable:
+            lines += [
+                "    elif value in EMPTY_VALUES:",
+                "        errors[%r] = 'This field cannot be empty.'; self.%s = None" % (name, name),
+            ]
+        inline_type = type(field).__dict__.get('inline_type')
+        if inline_type:
+            namespace["type_" + name] = inline_type[0]
+            lines += [
+                "    elif isinstance(value, type_%s):" % name,
+                "        self.%s = value" % name,
+                "    else:",
+                "        errors[%r] = %r; self.%s = None" % (name, inline_type[1], name),
+            ]
+        else:
+            namespace["valid_" + name] = field.valid_value
+            lines += [
+                "    else:",
+                "        try:",
+                "            self.%s = valid_%s(value)" % (name, name),
+                "        except ValidationError, e:",
+                "            errors[%r] = e.args[0]; self.%s = None" % (name, name),
+            ]
+    exec "\n".join(lines) in namespace
+    return namespace["valid_required_field"]
+
+
 class RequestMeta(type):
     """Metaclass for classes that would use validation.
     
     Sets proper labels to instances of `Field` class. Saves fields
-    for validation to `declared_defs` attribute.
+    for validation to `declared_defs` attribute and replaces them with
+    `__slots__` filled by a `valid_required_field` compiled for the class.
     """
 
     def __new__(cls, name, bases, attrs):
-        request_class = super(RequestMeta, cls).__new__(cls, name, bases, attrs)
-        request_class.declared_defs = {}
+        declared_defs = {}
         for attr_name, attr_value in attrs.items():
             if isinstance(attr_value, Field):
                 attr_value.name = attr_name
-                request_class.declared_defs[attr_name] = attr_value
+                declared_defs[attr_name] = attr_value
+                del attrs[attr_name]
+        attrs.setdefault('__slots__', tuple(declared_defs))
+        attrs['valid_required_field'] = compile_validator(declared_defs)
+        request_class = super(RequestMeta, cls).__new__(cls, name, bases, attrs)
+        request_class.declared_defs = declared_defs
         return request_class
 
 
 class BaseRequest(object):
     """Base class that uses fields validation.
+
+    Fields are set by `valid_required_field`; invalid and missing ones
+    are set to `None`.
     """
 
     __metaclass__ = RequestMeta
+    __slots__ = ('arguments_fied', 'default', 'error_field')
 
     def __init__(self, arguments_fied):
         self.arguments_fied = arguments_fied
         self.default = None
         self.error_field = {}
-    
-    '''The method is used to validate fields.'''
-    def valid_required_field(self):
-        for field, obj in self.declared_defs.items():
-            try:
-                setattr(self, field, self.arguments_fied.get(field, self.default))
-            except ValidationError, e:
-                self.error_field[field] = e.args[0]
 
 
 class ClientsInterestsRequest(BaseRequest):
@@ -211,61 +340,146 @@ class MethodRequest(BaseRequest):
         return self.login == ADMIN_LOGIN
 
 
+class AdminDigest(object):
+    """Admin token of the current hour, computed once per hour.
+
+    The token of the next hour is computed together with the current
+    one, so the hour boundary costs a swap instead of a hash.
+    """
+
+    def __init__(self):
+        self.current = (0, 0, None)
+        self.next = (0, 0, None)
+
+    def hour_digest(self, hour):
+        """Returns when the token of `hour` is valid and the token."""
+        digest = hashlib.sha512(hour.strftime("%Y%m%d%H") + ADMIN_SALT).hexdigest()
+        start = time.mktime(hour.timetuple())
+        end = time.mktime((hour + datetime.timedelta(hours=1)).timetuple())
+        return start, end, digest
+
+    def get(self):
+        now = time.time()
+        if not self.current[0] <= now < self.current[1]:
+            if self.next[0] <= now < self.next[1]:
+                self.current = self.next
+            else:
+                self.current = self.hour_digest(
+                    datetime.datetime.now().replace(minute=0, second=0, microsecond=0))
+            self.next = self.hour_digest(datetime.datetime.fromtimestamp(self.current[1]))
+        return self.current[2]
+
+
+ADMIN_DIGEST = AdminDigest()
+AUTH_CACHE = LocalCache(max_size=10000, ttl=24 * 60 * 60, name="auth")
+
+
 def check_auth(request):
     account = request.account.encode('utf-8') if request.account else ''
     login = request.login.encode('utf-8') if request.login else ''
+    token = request.token.encode('utf-8') if request.token else ''
 
     if request.is_admin:
-        digest = hashlib.sha512(
-            datetime.datetime.now().strftime("%Y%m%d%H") + 
-            ADMIN_SALT).hexdigest()
-    else:
-        digest = hashlib.sha512(account + login + SALT).hexdigest()
+        return hmac.compare_digest(ADMIN_DIGEST.get(), token)
 
-    if digest == request.token:
+    key = (account, login, token)
+    if AUTH_CACHE.get(key):
+        return True
+    digest = hashlib.sha512(account + login + SALT).hexdigest()
+    if hmac.compare_digest(digest, token):
+        AUTH_CACHE.set(key, True)
         return True
     return False
 
 
-def online_score_progress(method_request, ctx, store):
+def count_errors(error_field):
+    for field in error_field:
+        VALIDATION_ERRORS.inc((field,))
+
+
+def validate_method_request(body, ctx=None):
+    """Validates and authenticates the method request.
+
+    Returns the request and `None`, or `None` and the `(response, code)`
+    pair the request has to be answered with.
+    """
+    with stage(ctx, 'validate'):
+        method_request = MethodRequest(body)
+        method_request.valid_required_field()
+
+    if method_request.error_field:
+        count_errors(method_request.error_field)
+        return None, ("<Invalid fields: %s>" % (method_request.error_field), INVALID_REQUEST)
+
+    with stage(ctx, 'auth'):
+        authorized = check_auth(method_request)
+    if not authorized:
+        AUTH_FAILURES.inc()
+        return None, (None, FORBIDDEN)
+    return method_request, None
+
+
+def validate_online_score(method_request, ctx):
+    """Validates `online_score` arguments.
 
+    Returns the request to score and `None`, or `None` and the
+    `(response, code)` pair to answer with without scoring.
+    """
     request = OnlineScoreRequest(method_request.arguments)
     request.valid_required_field()
 
     if request.error_field:
-        return "<Invalid fields: %s>" % (request.error_field), INVALID_REQUEST
+        count_errors(request.error_field)
+        return None, ("<Invalid fields: %s>" % (request.error_field), INVALID_REQUEST)
 
     ctx['has'] =  [field for field in request.arguments_fied.keys() if getattr(request, field)]
     if method_request.is_admin:
-        return {"score": 42}, OK
+        return None, ({"score": 42}, OK)
 
     if request.phone and request.email or \
              request.first_name and request.last_name or \
              request.gender and request.birthday:
-        response = {
-            "score": get_score(
-                store, request.phone,
-                request.email, request.birthday,
-                request.gender, request.first_name,
-                request.last_name)}
-        return response, OK
+        return request, None
     else:
         invalid_field = [field for field in request.arguments_fied.keys() if not getattr(
             request, field)]
-        return "<Invalid fields: %s>" % (invalid_field), INVALID_REQUEST
+        return None, ("<Invalid fields: %s>" % (invalid_field), INVALID_REQUEST)
 
 
-def clients_interests_progress(method_request, ctx, store):
+def validate_clients_interests(method_request, ctx):
+    """Validates `clients_interests` arguments, see `validate_online_score`."""
     request = ClientsInterestsRequest(method_request.arguments)
     request.valid_required_field()
 
     if request.error_field:
-        return "<Invalid fields: %s>" % (request.error_field), INVALID_REQUEST
+        count_errors(request.error_field)
+        return None, ("<Invalid fields: %s>" % (request.error_field), INVALID_REQUEST)
 
     ctx['nclients'] = len(request.client_ids)
-    response = {}
-    for cid in request.client_ids:
-        response.update({str(cid): get_interests(store, cid)})
+    return request, None
+
+
+def online_score_progress(method_request, ctx, store):
+    request, answer = validate_online_score(method_request, ctx)
+    if answer:
+        return answer
+
+    response = {
+        "score": get_score(
+            store, request.phone,
+            request.email, request.birthday,
+            request.gender, request.first_name,
+            request.last_name, deadline=ctx.get('deadline'))}
+    return response, OK
+
+
+def clients_interests_progress(method_request, ctx, store):
+    request, answer = validate_clients_interests(method_request, ctx)
+    if answer:
+        return answer
+
+    interests = get_interests_many(store, request.client_ids, ctx.get('deadline'))
+    response = dict((str(cid), value) for cid, value in zip(request.client_ids, interests))
     return response, OK
 
 
@@ -275,78 +489,519 @@ def method_handler(request, ctx, store):
         'clients_interests': clients_interests_progress,
     }
 
-    method_request = MethodRequest(request['body'])
-    method_request.valid_required_field()
-
-    if method_request.error_field:
-        return "<Invalid fields: %s>" % (method_request.error_field), INVALID_REQUEST
-
-    if not check_auth(method_request):
-        return None, FORBIDDEN
+    if not isinstance(request['body'], dict):
+        return "<Invalid request: expected an object>", INVALID_REQUEST
+    method_request, answer = validate_method_request(request['body'], ctx)
+    if answer:
+        return answer
 
     if not method_request.method in handler:
         return None, FORBIDDEN
+    ctx['method'] = method_request.method
+
+    if ctx.get('deadline') and ctx['deadline'].expired:
+        return None, GATEWAY_TIMEOUT
 
     response, code = handler[method_request.method](method_request, ctx, store)
     return response, code
 
 
+MAX_BATCH_SIZE = 1000
+
+
+def batch_handler(request, ctx, store):
+    """Answers a list of method requests in order.
+
+    Every item is validated and authenticated on its own; the store
+    lookups of all valid items are made with one bulk call per kind.
+    """
+    if not isinstance(request['body'], list):
+        return "<Invalid batch: expected a list of method requests>", INVALID_REQUEST
+    if len(request['body']) > MAX_BATCH_SIZE:
+        return "<Invalid batch: more than %d method requests>" % MAX_BATCH_SIZE, INVALID_REQUEST
+
+    answers, scores, interests = [], [], []
+    ctx['items'] = []
+    for index, body in enumerate(request['body']):
+        item_ctx = {}
+        ctx['items'].append(item_ctx)
+        if not isinstance(body, dict):
+            answers.append(("<Invalid request: expected an object>", INVALID_REQUEST))
+            continue
+
+        method_request, answer = validate_method_request(body, ctx)
+        if answer:
+            pass
+        elif method_request.method == 'online_score':
+            item, answer = validate_online_score(method_request, item_ctx)
+            if item:
+                scores.append((index, item))
+        elif method_request.method == 'clients_interests':
+            item, answer = validate_clients_interests(method_request, item_ctx)
+            if item:
+                interests.append((index, item))
+        else:
+            answer = None, FORBIDDEN
+        answers.append(answer)
+
+    applicants = [dict((field, getattr(item, field)) for field in OnlineScoreRequest.declared_defs)
+                  for _, item in scores]
+    for (index, _), score in zip(scores, get_scores(store, applicants, ctx.get('deadline'))):
+        answers[index] = {"score": score}, OK
+
+    cids = list(set(cid for _, item in interests for cid in item.client_ids))
+    client_interests = dict(zip(cids, get_interests_many(store, cids, ctx.get('deadline'))))
+    for index, item in interests:
+        answers[index] = dict((str(cid), client_interests[cid]) for cid in item.client_ids), OK
+
+    return [make_response(response, code) for response, code in answers], OK
+
+
+def get_deadline(headers, timeout=None):
+    """Deadline of a request from its X-Request-Timeout header in seconds.
+
+    The server `timeout` is used without the header and caps it.
+    """
+    try:
+        requested = float(headers.get('X-Request-Timeout'))
+    except (TypeError, ValueError):
+        requested = None
+    if requested is not None and requested > 0:
+        timeout = min(requested, timeout) if timeout else requested
+    return Deadline(timeout) if timeout else None
+
+
+def make_response(response, code):
+    if code not in ERRORS:
+        return {"response": response, "code": code}
+    return {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+
+
 class MainHTTPHandler(BaseHTTPRequestHandler):
+    """Answers POST requests of `router` paths and GET /metrics.
+
+    Connections are kept alive between requests (pipelined requests
+    are answered in order) until the client closes them, they stay
+    idle for `idle_timeout` seconds or `max_requests` are answered.
+    A request is read within `timeout` seconds. A connection is closed
+    after its answer while accepted connections wait for a pool thread.
+    """
+
     router = {
-        "method": method_handler
+        "method": method_handler,
+        "batch": batch_handler,
     }
     store = Store(RedisStore())
+    request_timeout = None
+    codec = get_codec("json")
+    protocol_version = "HTTP/1.1"
+    timeout = 5
+    idle_timeout = 1
+    max_requests = 100
+    body_log_rate = 1.0
+    stage_timings = False
+    profiler = None
+    # Buffered, so the status line, headers and body go out in one send.
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.requests_served = 0
+
+    def handle_one_request(self):
+        if self.requests_served and self.idle_timeout:
+            self.connection.settimeout(self.idle_timeout)
+        BaseHTTPRequestHandler.handle_one_request(self)
+
+    def parse_request(self):
+        # The request line is in, the rest of the request gets `timeout`.
+        self.connection.settimeout(self.timeout)
+        return BaseHTTPRequestHandler.parse_request(self)
+
+    def log_message(self, format, *args):
+        """Access log line, through `logging` instead of straight to stderr."""
+        logging.info("%s - - %s", self.client_address[0], format % args)
 
     def get_request_id(self, headers):
         return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
 
+    def get_store(self):
+        return getattr(self.server, 'store', None) or self.store
+
+    def do_GET(self):
+        if self.path.strip("/") == "metrics":
+            self.send_body(OK, METRICS.render(), "text/plain; version=0.0.4")
+        else:
+            self.send_body(NOT_FOUND, self.codec.dumps(make_response(None, NOT_FOUND)))
+
     def do_POST(self):
+        started = time.time()
+        IN_FLIGHT.inc()
+        try:
+            if self.profiler and self.profiler.sample():
+                method, code = self.profiler.runcall(self.answer_post)
+            else:
+                method, code = self.answer_post()
+        finally:
+            IN_FLIGHT.dec()
+        REQUESTS.inc((method, str(code)))
+        REQUEST_LATENCY.observe((method,), time.time() - started)
+
+    def answer_post(self):
+        """Answers a POST request, returns its method for metrics and the code."""
         response, code = {}, OK
-        context = {"request_id": self.get_request_id(self.headers)}
-        request = None
+        path = self.path.strip("/")
+        context = {"request_id": self.get_request_id(self.headers),
+                   "deadline": get_deadline(self.headers, self.request_timeout)}
+        if self.stage_timings:
+            context["timings"] = Timings()
+        request, data_string = None, None
         try:
-            data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string)
+            length = int(self.headers['Content-Length'])
+            if length < 0:
+                raise ValueError("Negative Content-Length")
+            with stage(context, "read"):
+                data_string = self.rfile.read(length)
+            with stage(context, "decode"):
+                request = self.codec.loads(data_string)
         except:
             code = BAD_REQUEST
+            if data_string is None:
+                # The body was not read, the next request can not be found.
+                self.close_connection = 1
 
-        if request:
-            path = self.path.strip("/")
-            logging.info("%s: %s %s" % (self.path, data_string, context["request_id"]))
+        if request is not None:
+            if self.body_log_rate >= 1 or random.random() < self.body_log_rate:
+                logging.info("%s: %s %s", self.path, data_string, context["request_id"],
+                             extra={"request_id": context["request_id"], "path": self.path})
 
             if path in self.router:
+                store = self.get_store()
+                if self.stage_timings:
+                    store = TimedStore(store, context["timings"])
                 try:
-                    response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
+                    with stage(context, "handler"):
+                        response, code = self.router[path]({"body": request, "headers": self.headers}, context, store)
                 except Exception, e:
                     logging.exception("Unexpected error: %s" % e)
                     code = INTERNAL_ERROR
             else:
                 code = NOT_FOUND
 
+        with stage(context, "encode"):
+            body = self.codec.dumps(make_response(response, code))
+        self.send_body(code, body)
+        if self.stage_timings:
+            logging.info("%s %s %s", context["request_id"], body, context["timings"].format(),
+                         extra={"request_id": context["request_id"], "code": code, "timings": context["timings"]})
+        else:
+            logging.info("%s %s", context["request_id"], body,
+                         extra={"request_id": context["request_id"], "code": code})
+        return context.get("method") or (path if path in self.router else "unknown"), code
+
+    def send_body(self, code, body, content_type="application/json"):
         self.send_response(code)
-        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.requests_served += 1
+        if self.max_requests and self.requests_served >= self.max_requests:
+            self.close_connection = 1
+        waiting = getattr(self.server, "requests", None)
+        if waiting is not None and waiting.qsize() > 0:
+            # An idle connection would keep the pool thread from the waiting ones.
+            self.close_connection = 1
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        elif self.request_version != "HTTP/1.1":
+            self.send_header("Connection", "keep-alive")
         self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
-        else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
-        context.update(r)
-        logging.info(context)
-        self.wfile.write(json.dumps(r))
-        return
+        self.wfile.write(body)
+
+#***********************************************SERVER******************************************************************
+
+class ScoringHTTPServer(HTTPServer):
+    """HTTP server that gives every worker its own `Store`.
+
+    The store is built lazily by `store_factory` in the thread that
+    serves the request, so forked processes and pool threads never
+    share a connection.
+    """
+
+    def __init__(self, server_address, handler_class, store_factory=None):
+        HTTPServer.__init__(self, server_address, handler_class)
+        self.store_factory = store_factory
+        self.local = threading.local()
+
+    @property
+    def store(self):
+        if self.store_factory is None:
+            return None
+        store = getattr(self.local, 'store', None)
+        if store is None:
+            store = self.local.store = self.store_factory()
+        return store
+
+
+class ThreadPoolHTTPServer(ScoringHTTPServer):
+    """HTTP server that handles requests in a fixed pool of threads.
+
+    Threads are started by `serve_forever`, so the server can be
+    created before forking worker processes.
+    """
+
+    def __init__(self, server_address, handler_class, store_factory=None, threads=4):
+        ScoringHTTPServer.__init__(self, server_address, handler_class, store_factory)
+        self.threads = threads
+        self.requests = Queue.Queue(threads * 2)
+        self.workers = []
+
+    def start_workers(self):
+        while len(self.workers) < self.threads:
+            worker = threading.Thread(target=self.process_request_thread)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def serve_forever(self, poll_interval=0.5):
+        self.start_workers()
+        HTTPServer.serve_forever(self, poll_interval)
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    def process_request_thread(self):
+        while True:
+            request, client_address = self.requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _wait_child(pid):
+    while True:
+        try:
+            return os.waitpid(pid, 0)
+        except OSError, e:
+            # Interrupted by a signal with a handler, like SIGUSR1 of the profiler.
+            if e.errno != errno.EINTR:
+                raise
+
+
+def serve_prefork(server, workers):
+    """Serves `server` from `workers` forked processes.
+
+    The listening socket is shared by all children and switched to
+    non-blocking mode, so a child that loses the race for `accept`
+    goes back to `select` instead of hanging. SIGTERM or Ctrl-C in
+    the parent stops the children and waits for them to exit.
+    """
+    server.socket.setblocking(0)
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            random.seed()
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                logging.shutdown()
+                os._exit(0)
+        children.append(pid)
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    try:
+        for pid in children:
+            _wait_child(pid)
+    except KeyboardInterrupt:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in children:
+            try:
+                _wait_child(pid)
+            except OSError:
+                pass
+
+
+def add_redis_options(op):
+    op.add_option("--redis-host", action="store", default="localhost")
+    op.add_option("--redis-port", action="store", type=int, default=6379)
+    op.add_option("--redis-db", action="store", type=int, default=0)
+    op.add_option("--redis-nodes", action="store", default=None,
+                  help="comma separated host:port[/db] of Redis nodes to shard keys over, replaces host and port")
+    op.add_option("--redis-previous-nodes", action="store", default=None,
+                  help="--redis-nodes before they changed, keys missing on their node are read from their old one")
+    op.add_option("--redis-socket", action="store", default=None,
+                  help="path of the Redis unix socket, replaces host and port")
+    op.add_option("--redis-timeout", action="store", type=float, default=None,
+                  help="seconds to wait for a Redis reply")
+    op.add_option("--redis-connect-timeout", action="store", type=float, default=None,
+                  help="seconds to wait for a Redis connection, defaults to --redis-timeout")
+    op.add_option("--redis-max-connections", action="store", type=int, default=None,
+                  help="size of the Redis connection pool of every worker process")
+    op.add_option("--redis-keepalive", action="store_true", default=False,
+                  help="enable TCP keepalive on Redis connections")
+    op.add_option("--breaker-threshold", action="store", type=int, default=5,
+                  help="failed cache calls in a row that stop cache calls")
+    op.add_option("--breaker-timeout", action="store", type=float, default=5,
+                  help="seconds cache calls stay stopped before a trial call")
+
+
+def add_log_options(op):
+    op.add_option("--log-format", action="store", type="choice", choices=["text", "json"], default="text",
+                  help="text lines or JSON lines with request_id, path, code and timings fields")
+    op.add_option("--log-queue", action="store", type=int, default=0,
+                  help="records waiting for a background writer thread, 0 writes them synchronously")
+    op.add_option("--log-body-rate", action="store", type=float, default=1.0,
+                  help="share of request bodies logged, from 0 to 1")
+
+
+def add_scoring_options(op):
+    op.add_option("--scoring", action="store", type="choice", choices=scoring.MODES, default="cache",
+                  help="cache reads scores through the store, inline computes them on every request, "
+                       "auto is inline for scorers declared cheap")
+    op.add_option("--scorer", action="store", default="scoring:calc_score",
+                  help="module:function computing a score")
+    op.add_option("--scoring-cache-writes", action="store_true", default=False,
+                  help="write inline computed scores to the store cache")
+    op.add_option("--single-flight", action="store_true", default=False,
+                  help="concurrent lookups of the same score share one cache read and computation")
+
+
+def setup_scoring(opts):
+    scoring.SCORER = scoring.Scorer(scoring.load_scorer(opts.scorer), opts.scoring, opts.scoring_cache_writes,
+                                    opts.single_flight)
+
+
+def redis_options(opts):
+    return {
+        "host": opts.redis_host,
+        "port": opts.redis_port,
+        "db": opts.redis_db,
+        "unix_socket": opts.redis_socket,
+        "timeout": opts.redis_timeout,
+        "connect_timeout": opts.redis_connect_timeout,
+        "max_connections": opts.redis_max_connections,
+        "keepalive": opts.redis_keepalive,
+    }
+
+
+def redis_backend(opts):
+    """`RedisStore` of the options, or a `ShardedStore` over `--redis-nodes`."""
+    if not opts.redis_nodes:
+        return RedisStore(**redis_options(opts))
+    stores = {}
+
+    def redis_nodes(names):
+        nodes = []
+        for node in names.split(","):
+            node = node.strip()
+            if node not in stores:
+                address, _, db = node.partition("/")
+                host, _, port = address.rpartition(":")
+                stores[node] = RedisStore(**dict(redis_options(opts), host=host or "localhost", port=int(port),
+                                                 db=int(db) if db else opts.redis_db, unix_socket=None))
+            nodes.append((node, stores[node]))
+        return nodes
+
+    previous = redis_nodes(opts.redis_previous_nodes) if opts.redis_previous_nodes else None
+    return ShardedStore(redis_nodes(opts.redis_nodes), previous=previous)
+
+
+def make_server(address, store_factory, threads=0):
+    if threads > 0:
+        return ThreadPoolHTTPServer(address, MainHTTPHandler, store_factory, threads)
+    return ScoringHTTPServer(address, MainHTTPHandler, store_factory)
 
 
 if __name__ == "__main__":
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("-w", "--workers", action="store", type=int, default=1,
+                  help="number of pre-forked worker processes")
+    op.add_option("-t", "--threads", action="store", type=int, default=0,
+                  help="size of the request thread pool in every worker")
+    op.add_option("--local-cache", action="store", type=int, default=0,
+                  help="number of scores cached in every worker process, 0 disables the cache")
+    op.add_option("--local-cache-ttl", action="store", type=int, default=60,
+                  help="seconds a score stays in the local cache")
+    op.add_option("--request-timeout", action="store", type=float, default=None,
+                  help="seconds to answer a request, X-Request-Timeout header may lower it")
+    op.add_option("--read-timeout", action="store", type=float, default=5,
+                  help="seconds to read a request once it started")
+    op.add_option("--keepalive-timeout", action="store", type=float, default=1,
+                  help="seconds an idle keep-alive connection stays open")
+    op.add_option("--keepalive-requests", action="store", type=int, default=100,
+                  help="requests answered on one connection before it is closed, 0 for no limit; "
+                       "without --threads every connection is closed after one request")
+    op.add_option("--json", action="store", type="choice", choices=CODECS, default="auto",
+                  help="JSON codec: %s, auto picks the fastest installed" % ", ".join(CODECS))
+    op.add_option("--store", action="store", type="choice", choices=["redis", "memory"], default="redis",
+                  help="backend of scores and interests, memory keeps them in every worker process")
+    op.add_option("--timings", action="store_true", default=False,
+                  help="log the time of every request stage")
+    op.add_option("--profile-rate", action="store", type=float, default=0,
+                  help="share of requests run under cProfile, stats are written on SIGUSR1")
+    op.add_option("--profile-output", action="store", default="api.prof",
+                  help="file of the profile stats, the process id is appended")
+    op.add_option("--write-behind", action="store_true", default=False,
+                  help="write cached scores from a background thread, a worker exiting loses the waiting ones")
+    op.add_option("--write-behind-batch", action="store", type=int, default=100,
+                  help="cached scores written in one pipelined call")
+    op.add_option("--write-behind-interval", action="store", type=float, default=0.05,
+                  help="seconds a cached score waits at most for a full batch")
+    op.add_option("--write-behind-max", action="store", type=int, default=10000,
+                  help="cached scores waiting in every worker process before new ones are dropped")
+    add_log_options(op)
+    add_scoring_options(op)
+    add_redis_options(op)
     (opts, args) = op.parse_args()
-    logging.basicConfig(filename=opts.log, level=logging.INFO,
-                        format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
-    logging.info("Starting server at %s" % opts.port)
+    setup_logging(opts.log, opts.log_format == "json", opts.log_queue)
+    setup_scoring(opts)
+    cache = LocalCache(opts.local_cache, opts.local_cache_ttl) if opts.local_cache else None
+    backend = MemoryStore() if opts.store == "memory" else redis_backend(opts)
+    breaker = CircuitBreaker(opts.breaker_threshold, opts.breaker_timeout)
+    write_behind = None
+    if opts.write_behind:
+        write_behind = WriteBehindStore(Store(backend, breaker=breaker), opts.write_behind_batch,
+                                        opts.write_behind_interval, opts.write_behind_max)
+
+    def store_factory():
+        store = write_behind or Store(backend, breaker=breaker)
+        return CachedStore(store, cache) if cache else store
+
+    MainHTTPHandler.request_timeout = opts.request_timeout
+    MainHTTPHandler.codec = get_codec(opts.json)
+    MainHTTPHandler.timeout = opts.read_timeout
+    MainHTTPHandler.idle_timeout = opts.keepalive_timeout
+    MainHTTPHandler.body_log_rate = opts.log_body_rate
+    MainHTTPHandler.stage_timings = opts.timings
+    if opts.profile_rate:
+        MainHTTPHandler.profiler = Profiler(opts.profile_rate, opts.profile_output)
+        MainHTTPHandler.profiler.install()
+    # Without a thread pool an idle connection would block every other client.
+    MainHTTPHandler.max_requests = opts.keepalive_requests if opts.threads > 0 else 1
+    server = make_server(("localhost", opts.port), store_factory, opts.threads)
+    logging.info("Starting server at %s (workers: %s, threads: %s, json: %s)" % (
+        opts.port, opts.workers, opts.threads, MainHTTPHandler.codec.name))
     try:
-        server.serve_forever()
+        if opts.workers > 1:
+            serve_prefork(server, opts.workers)
+        else:
+            server.serve_forever()
     except KeyboardInterrupt:
         pass
+    if write_behind is not None:
+        write_behind.flush()
     server.server_close()
\ No newline at end of file
@@ -0,0 +1,365 @@
+import json
+import random
+import socket
+import asyncore
+import logging
+import mimetools
+import uuid
+from cStringIO import StringIO
+from optparse import OptionParser
+from BaseHTTPServer import BaseHTTPRequestHandler
+
+import api
+from api import OK, BAD_REQUEST, FORBIDDEN, NOT_FOUND, INTERNAL_ERROR, GATEWAY_TIMEOUT
+from codec import get_codec, NAMES as CODECS
+from eventloop import EventLoop, Future, Return, coroutine
+from logqueue import setup_logging
+import scoring
+from scoring import SCORE_EXPIRE, SINGLE_FLIGHT, get_score_key
+from store import AsyncStore, AsyncRedisStore, CircuitBreaker
+
+
+FLIGHTS = {}
+
+
+def single_flight(key, start, loop=None, deadline=None, fallback=None):
+    """Future of the running `start()` call of `key`, started when there is none.
+
+    A follower given a `deadline` gets `fallback()` once it expires if
+    the running call has not finished by then. The event loop runs one
+    callback at a time, so no lock is needed.
+    """
+    future = FLIGHTS.get(key)
+    if future is not None:
+        SINGLE_FLIGHT.inc(("follower",))
+        if deadline is None:
+            return future
+        result = Future()
+
+        def expire():
+            if not result.done():
+                SINGLE_FLIGHT.inc(("timeout",))
+                result.set_result(fallback())
+
+        timer = loop.call_later(deadline.remaining(), expire)
+
+        def finish(future):
+            timer.cancel()
+            if future.exc_info():
+                result.set_exc_info(future.exc_info())
+            else:
+                result.set_result(future.result())
+
+        future.add_done_callback(finish)
+        return result
+    SINGLE_FLIGHT.inc(("leader",))
+    future = FLIGHTS[key] = start()
+    future.add_done_callback(lambda future: FLIGHTS.pop(key, None))
+    return future
+
+
+@coroutine
+def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None,
+              deadline=None):
+    scorer = scoring.SCORER
+    if scorer.inline:
+        score = scorer.func(phone, email, birthday, gender, first_name, last_name)
+        if scorer.cache_writes:
+            # Not waited for: the answer does not depend on the write.
+            store.cache_set(get_score_key(phone, birthday, first_name, last_name), score, SCORE_EXPIRE,
+                            deadline=deadline)
+        raise Return(score)
+    key = get_score_key(phone, birthday, first_name, last_name)
+    applicant = (phone, email, birthday, gender, first_name, last_name)
+    if scorer.flights is not None:
+        score = yield single_flight(key, lambda: read_through(store, scorer, key, applicant, deadline),
+                                    store.loop, deadline, lambda: scorer.func(*applicant))
+    else:
+        score = yield read_through(store, scorer, key, applicant, deadline)
+    raise Return(score)
+
+
+@coroutine
+def read_through(store, scorer, key, applicant, deadline=None):
+    score = float((yield store.cache_get(key, deadline=deadline)) or 0)
+    if score:
+        raise Return(score)
+    score = scorer.func(*applicant)
+    yield store.cache_set(key, score, SCORE_EXPIRE, deadline=deadline)
+    raise Return(score)
+
+
+@coroutine
+def get_interests_many(store, cids, deadline=None):
+    values = yield store.get_many(["i:%s" % cid for cid in cids], deadline=deadline)
+    raise Return([json.loads(r) if r else [] for r in values])
+
+
+@coroutine
+def online_score_progress(method_request, ctx, store):
+    request, answer = api.validate_online_score(method_request, ctx)
+    if answer:
+        raise Return(answer)
+
+    score = yield get_score(
+        store, request.phone,
+        request.email, request.birthday,
+        request.gender, request.first_name,
+        request.last_name, deadline=ctx.get('deadline'))
+    raise Return(({"score": score}, OK))
+
+
+@coroutine
+def clients_interests_progress(method_request, ctx, store):
+    request, answer = api.validate_clients_interests(method_request, ctx)
+    if answer:
+        raise Return(answer)
+
+    interests = yield get_interests_many(store, request.client_ids, ctx.get('deadline'))
+    response = dict((str(cid), value) for cid, value in zip(request.client_ids, interests))
+    raise Return((response, OK))
+
+
+@coroutine
+def method_handler(request, ctx, store):
+    handler = {
+        'online_score': online_score_progress,
+        'clients_interests': clients_interests_progress,
+    }
+
+    method_request, answer = api.validate_method_request(request['body'])
+    if answer:
+        raise Return(answer)
+
+    if not method_request.method in handler:
+        raise Return((None, FORBIDDEN))
+
+    if ctx.get('deadline') and ctx['deadline'].expired:
+        raise Return((None, GATEWAY_TIMEOUT))
+
+    response, code = yield handler[method_request.method](method_request, ctx, store)
+    raise Return((response, code))
+
+
+class HTTPConnection(asyncore.dispatcher):
+    """Client connection of `AsyncHTTPServer`.
+
+    Requests are answered one at a time in the order they arrive, so
+    pipelined requests on a keep-alive connection stay ordered.
+    """
+
+    MAX_HEADER_SIZE = 65536
+
+    def __init__(self, sock, server):
+        asyncore.dispatcher.__init__(self, sock, map=server.loop.map)
+        self.server = server
+        self.inbuf = ''
+        self.outbuf = ''
+        self.busy = False
+        self.closing = False
+        self.processing = False
+        self.last_activity = server.loop.time()
+
+    def readable(self):
+        return not self.closing
+
+    def writable(self):
+        return bool(self.outbuf)
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if not data:
+            return
+        self.last_activity = self.server.loop.time()
+        self.inbuf += data
+        self.process()
+
+    def handle_write(self):
+        sent = self.send(self.outbuf)
+        self.outbuf = self.outbuf[sent:]
+        if not self.outbuf and self.closing:
+            self.handle_close()
+
+    def handle_close(self):
+        self.closing = True
+        self.close()
+        self.server.connections.discard(self)
+
+    def process(self):
+        """Starts the buffered requests one after another.
+
+        A request answered at once calls `reply`, whose `process` call
+        returns here and the loop goes on, so a long pipeline does not
+        nest calls.
+        """
+        if self.processing:
+            return
+        self.processing = True
+        try:
+            while not self.busy and not self.closing and self.start_request():
+                pass
+        finally:
+            self.processing = False
+
+    def start_request(self):
+        """Starts the first buffered request, returns False if it is incomplete."""
+        end = self.inbuf.find('\r\n\r\n')
+        if end < 0:
+            if len(self.inbuf) > self.MAX_HEADER_SIZE:
+                self.reply_error(BAD_REQUEST)
+            return False
+        lines = self.inbuf[:end].split('\r\n')
+        words = lines[0].split()
+        if len(words) != 3:
+            self.reply_error(BAD_REQUEST)
+            return False
+        command, path, version = words
+        headers = mimetools.Message(StringIO('\r\n'.join(lines[1:]) + '\r\n\r\n'))
+        try:
+            length = int(headers.get('Content-Length') or 0)
+            if length < 0:
+                raise ValueError("Negative Content-Length")
+        except ValueError:
+            self.reply_error(BAD_REQUEST)
+            return False
+        if len(self.inbuf) < end + 4 + length:
+            return False
+        body = self.inbuf[end + 4:end + 4 + length]
+        self.inbuf = self.inbuf[end + 4 + length:]
+
+        connection = headers.get('Connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+
+        self.busy = True
+        self.server.handle_request(command, path, headers, body).add_done_callback(
+            lambda future: self.reply(future.result()[0], future.result()[1], keep_alive))
+        return True
+
+    def reply_error(self, code):
+        self.reply(code, self.server.codec.dumps(api.make_response(None, code)), False)
+
+    def reply(self, code, body, keep_alive):
+        self.busy = False
+        if self.closing:
+            return
+        lines = [
+            "HTTP/1.1 %d %s" % (code, BaseHTTPRequestHandler.responses.get(code, ('',))[0]),
+            "Content-Type: application/json",
+            "Content-Length: %d" % len(body),
+            "Connection: %s" % ('keep-alive' if keep_alive else 'close'),
+        ]
+        self.outbuf += '\r\n'.join(lines) + '\r\n\r\n' + body
+        self.last_activity = self.server.loop.time()
+        if not keep_alive:
+            self.closing = True
+        else:
+            self.process()
+
+
+class AsyncHTTPServer(asyncore.dispatcher):
+    """HTTP server answering `router` requests on an `EventLoop`.
+
+    All connections are served by one thread; store calls return
+    futures, so a slow Redis reply only delays its own request.
+    Connections idle for `keepalive_timeout` seconds are closed.
+    """
+
+    router = {
+        "method": method_handler
+    }
+    codec = get_codec("json")
+    body_log_rate = 1.0
+
+    def __init__(self, address, loop, store, keepalive_timeout=60, request_timeout=None):
+        asyncore.dispatcher.__init__(self, map=loop.map)
+        self.loop = loop
+        self.store = store
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self.connections = set()
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(address)
+        self.listen(1024)
+        self.loop.call_later(1, self.close_idle)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is None:
+            return
+        self.connections.add(HTTPConnection(pair[0], self))
+
+    def close_idle(self):
+        limit = self.loop.time() - self.keepalive_timeout
+        for connection in list(self.connections):
+            if not connection.busy and not connection.outbuf and connection.last_activity < limit:
+                connection.handle_close()
+        self.loop.call_later(1, self.close_idle)
+
+    @coroutine
+    def handle_request(self, command, path, headers, body):
+        if command != 'POST':
+            raise Return((NOT_FOUND, self.codec.dumps(api.make_response(None, NOT_FOUND))))
+
+        response, code = {}, OK
+        context = {"request_id": headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex),
+                   "deadline": api.get_deadline(headers, self.request_timeout)}
+        request = None
+        try:
+            request = self.codec.loads(body)
+        except:
+            code = BAD_REQUEST
+
+        if request:
+            if self.body_log_rate >= 1 or random.random() < self.body_log_rate:
+                logging.info("%s: %s %s", path, body, context["request_id"],
+                             extra={"request_id": context["request_id"], "path": path})
+            path = path.strip("/")
+            if path in self.router:
+                try:
+                    response, code = yield self.router[path]({"body": request, "headers": headers}, context, self.store)
+                except Exception, e:
+                    logging.exception("Unexpected error: %s" % e)
+                    code = INTERNAL_ERROR
+            else:
+                code = NOT_FOUND
+
+        body = self.codec.dumps(api.make_response(response, code))
+        logging.info("%s %s", context["request_id"], body,
+                     extra={"request_id": context["request_id"], "code": code})
+        raise Return((code, body))
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-p", "--port", action="store", type=int, default=8080)
+    op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("--keepalive-timeout", action="store", type=float, default=60)
+    op.add_option("--request-timeout", action="store", type=float, default=None)
+    op.add_option("--json", action="store", type="choice", choices=CODECS, default="auto",
+                  help="JSON codec: %s, auto picks the fastest installed" % ", ".join(CODECS))
+    api.add_log_options(op)
+    api.add_scoring_options(op)
+    api.add_redis_options(op)
+    (opts, args) = op.parse_args()
+    if opts.redis_nodes:
+        op.error("--redis-nodes is not supported by the async server")
+    setup_logging(opts.log, opts.log_format == "json", opts.log_queue)
+    api.setup_scoring(opts)
+    loop = EventLoop()
+    redis_store = AsyncRedisStore(
+        loop, host=opts.redis_host, db=opts.redis_db, port=opts.redis_port, timeout=opts.redis_timeout,
+        keepalive=opts.redis_keepalive, unix_socket=opts.redis_socket)
+    store = AsyncStore(redis_store, loop, breaker=CircuitBreaker(opts.breaker_threshold, opts.breaker_timeout))
+    AsyncHTTPServer.codec = get_codec(opts.json)
+    AsyncHTTPServer.body_log_rate = opts.log_body_rate
+    server = AsyncHTTPServer(("localhost", opts.port), loop, store, opts.keepalive_timeout, opts.request_timeout)
+    logging.info("Starting async server at %s" % opts.port)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    server.close()
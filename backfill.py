@@ -0,0 +1,135 @@
+"""Offline answers to a JSONL file of method requests.
+
+Reads method requests one JSON object per line (a `{"body": ...}`
+wrapper is unwrapped), answers them with `api.method_handler` on a
+pool of threads and writes one JSON response per request line, in the
+order of the input. Lines are read in chunks of `--chunk-size`: one
+chunk is answered while the previous one is written, so memory does
+not grow with the input. Throughput is logged every
+`--report-interval` seconds and at the end.
+
+    python -m backfill requests.jsonl --output responses.jsonl --threads 8
+    cat requests.jsonl | python -m backfill - > responses.jsonl
+"""
+import itertools
+import logging
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+
+import api
+from api import BAD_REQUEST, INVALID_REQUEST, INTERNAL_ERROR, method_handler, make_response
+from codec import get_codec, NAMES as CODECS
+from logqueue import setup_logging
+from store import Store, MemoryStore, CircuitBreaker
+
+
+CHUNK_SIZE = 1000
+
+
+class Backfill(object):
+    """Answers JSONL lines of method requests with `store`.
+
+    Counts the requests answered by code in `codes`.
+    """
+
+    def __init__(self, store, codec=None, threads=8, chunk_size=CHUNK_SIZE, report_interval=10):
+        self.store = store
+        self.codec = codec or get_codec()
+        self.threads = threads
+        self.chunk_size = chunk_size
+        self.report_interval = report_interval
+        self.codes = {}
+        self.requests = 0
+        self.started = None
+        self.next_report = None
+
+    def answer(self, line):
+        try:
+            body = self.codec.loads(line)
+        except Exception:
+            return None, BAD_REQUEST
+        if isinstance(body, dict) and isinstance(body.get("body"), dict):
+            body = body["body"]
+        if not isinstance(body, dict):
+            return "<Invalid request: expected an object>", INVALID_REQUEST
+        try:
+            return method_handler({"body": body, "headers": {}}, {}, self.store)
+        except Exception, e:
+            logging.exception("Unexpected error: %s" % e)
+            return None, INTERNAL_ERROR
+
+    def encode(self, line):
+        response, code = self.answer(line)
+        return code, self.codec.dumps(make_response(response, code))
+
+    def write(self, answers, output):
+        output.write("".join(body + "\n" for _, body in answers))
+        for code, _ in answers:
+            self.codes[code] = self.codes.get(code, 0) + 1
+        self.requests += len(answers)
+        if time.time() >= self.next_report:
+            self.next_report = time.time() + self.report_interval
+            logging.info(self.progress())
+
+    def progress(self):
+        elapsed = time.time() - self.started
+        return "%d requests in %.1fs, %.0f/s, codes: %s" % (
+            self.requests, elapsed, self.requests / elapsed if elapsed else 0.0,
+            ", ".join("%s: %d" % item for item in sorted(self.codes.items())))
+
+    def run(self, lines, output):
+        """Writes the response of every non-blank line of `lines` to `output`."""
+        self.started = time.time()
+        self.next_report = self.started + self.report_interval
+        lines = (line for line in lines if line.strip())
+        pool = ThreadPool(self.threads)
+        try:
+            answering = None
+            while True:
+                chunk = list(itertools.islice(lines, self.chunk_size))
+                answered, answering = answering, pool.map_async(self.encode, chunk) if chunk else None
+                if answered is not None:
+                    self.write(answered.get(), output)
+                if answering is None:
+                    break
+        finally:
+            pool.terminate()
+            pool.join()
+        logging.info(self.progress())
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] requests.jsonl|-")
+    op.add_option("-o", "--output", action="store", default=None, help="file of the responses, stdout by default")
+    op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("-t", "--threads", action="store", type=int, default=8,
+                  help="threads answering requests, they overlap store round trips")
+    op.add_option("--chunk-size", action="store", type=int, default=CHUNK_SIZE,
+                  help="requests read at a time, two chunks are held in memory")
+    op.add_option("--report-interval", action="store", type=float, default=10,
+                  help="seconds between throughput log lines")
+    op.add_option("--json", action="store", type="choice", choices=CODECS, default="auto",
+                  help="JSON codec: %s, auto picks the fastest installed" % ", ".join(CODECS))
+    op.add_option("--store", action="store", type="choice", choices=["redis", "memory"], default="redis",
+                  help="backend of scores and interests")
+    api.add_scoring_options(op)
+    api.add_redis_options(op)
+    (opts, args) = op.parse_args()
+    if len(args) != 1:
+        op.error("expected one JSONL file of method requests, - for stdin")
+    setup_logging(opts.log)
+    api.setup_scoring(opts)
+    backend = MemoryStore() if opts.store == "memory" else api.redis_backend(opts)
+    store = Store(backend, breaker=CircuitBreaker(opts.breaker_threshold, opts.breaker_timeout))
+    backfill = Backfill(store, get_codec(opts.json), opts.threads, opts.chunk_size, opts.report_interval)
+    source = sys.stdin if args[0] == "-" else open(args[0])
+    output = open(opts.output, "w") if opts.output else sys.stdout
+    try:
+        backfill.run(source, output)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if source is not sys.stdin:
+            source.close()
@@ -0,0 +1,230 @@
+"""Load test of a running api.py server.
+
+Replays method requests from a JSONL corpus, or synthesizes valid
+`online_score` and `clients_interests` requests with correct tokens,
+from `--concurrency` keep-alive connections for `--duration` seconds or
+`--requests` requests. With `--rate` requests are sent on a fixed
+schedule and latency counts from the scheduled time, so a stalled
+server is not hidden by senders waiting on it. `--local` starts the
+server in-process on an in-memory store instead of using `--url`.
+
+    python -m benchmarks.load --url http://localhost:8080 --concurrency 16 --duration 30
+    python -m benchmarks.load --local --threads 8 --rate 2000 --corpus requests.jsonl --sign
+"""
+import datetime
+import hashlib
+import httplib
+import json
+import random
+import sys
+import threading
+import time
+import urlparse
+from optparse import OptionParser
+
+import api
+from benchmarks.validation import read_corpus
+from store import Store, MemoryStore
+
+
+CLIENTS = 1000
+INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
+
+
+def sign(body):
+    """Sets the token `api.check_auth` expects for the account and login of `body`."""
+    if body.get("login") == api.ADMIN_LOGIN:
+        msg = datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT
+    else:
+        msg = (body.get("account") or "") + (body.get("login") or "") + api.SALT
+    if isinstance(msg, unicode):
+        msg = msg.encode('utf-8')
+    body["token"] = hashlib.sha512(msg).hexdigest()
+    return body
+
+
+def synthetic_corpus(size, seed):
+    rnd = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        if rnd.random() < 0.7:
+            arguments = rnd.choice([
+                {"phone": "7%010d" % rnd.randint(0, 10 ** 10 - 1), "email": "user%d@mail.ru" % rnd.randint(0, 10 ** 6)},
+                {"first_name": rnd.choice(["Niels", "Marie", "Paul"]), "last_name": rnd.choice(["Bohr", "Curie", "Dirac"])},
+                {"gender": rnd.choice([1, 2]), "birthday": "%02d.%02d.%d" % (
+                    rnd.randint(1, 28), rnd.randint(1, 12), rnd.randint(1960, 2005))},
+            ])
+            body = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": arguments}
+        else:
+            arguments = {"client_ids": rnd.sample(range(CLIENTS), rnd.randint(1, 5)), "date": "20.07.2017"}
+            body = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
+        corpus.append(sign(body))
+    return corpus
+
+
+def start_local_server(threads, seed):
+    backend = MemoryStore()
+    rnd = random.Random(seed)
+    for cid in range(CLIENTS):
+        backend.set("i:%s" % cid, json.dumps(rnd.sample(INTERESTS, 2)))
+    store = Store(backend)
+
+    class Handler(api.MainHTTPHandler):
+        max_requests = api.MainHTTPHandler.max_requests if threads > 0 else 1
+
+        def log_message(self, *args):
+            pass
+
+    if threads > 0:
+        server = api.ThreadPoolHTTPServer(("localhost", 0), Handler, lambda: store, threads)
+    else:
+        server = api.ScoringHTTPServer(("localhost", 0), Handler, lambda: store)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class Worker(threading.Thread):
+    """Sends requests over one keep-alive connection, reconnecting after errors."""
+
+    def __init__(self, host, port, path, bodies, stop_at, interval=None, limit=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.host, self.port, self.path = host, port, path
+        self.bodies = bodies
+        self.stop_at = stop_at
+        self.interval = interval
+        self.limit = limit
+        self.latencies = []
+        self.codes = {}
+        self.errors = 0
+
+    def run(self):
+        conn = None
+        scheduled = time.time()
+        index = 0
+        while time.time() < self.stop_at and (self.limit is None or index < self.limit):
+            if self.interval:
+                delay = scheduled - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                started = scheduled
+                scheduled += self.interval
+            else:
+                started = time.time()
+            body = self.bodies[index % len(self.bodies)]
+            index += 1
+            try:
+                if conn is None:
+                    conn = httplib.HTTPConnection(self.host, self.port, timeout=10)
+                conn.request("POST", self.path, body, {"Content-Type": "application/json"})
+                response = conn.getresponse()
+                code = json.loads(response.read()).get("code")
+                if response.getheader("Connection", "").lower() == "close":
+                    conn.close()
+                    conn = None
+            except Exception:
+                self.errors += 1
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                continue
+            self.latencies.append(time.time() - started)
+            self.codes[code] = self.codes.get(code, 0) + 1
+        if conn is not None:
+            conn.close()
+
+
+def percentile(values, share):
+    """Nearest-rank percentile of sorted `values`."""
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+def run(url, corpus, concurrency, duration, requests=None, rate=None):
+    parsed = urlparse.urlparse(url)
+    bodies = [json.dumps(body) for body in corpus]
+    stop_at = time.time() + duration
+    interval = float(concurrency) / rate if rate else None
+    limit = -(-requests // concurrency) if requests else None
+    workers = []
+    for number in range(concurrency):
+        offset = number * len(bodies) // concurrency
+        workers.append(Worker(parsed.hostname, parsed.port or 80, parsed.path or "/method/",
+                              bodies[offset:] + bodies[:offset], stop_at, interval, limit))
+    started = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - started
+
+    latencies = sorted(latency for worker in workers for latency in worker.latencies)
+    codes = {}
+    for worker in workers:
+        for code, count in worker.codes.items():
+            codes[code] = codes.get(code, 0) + count
+    return {
+        "requests": len(latencies),
+        "errors": sum(worker.errors for worker in workers),
+        "codes": codes,
+        "seconds": elapsed,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "max": latencies[-1] if latencies else 0.0,
+    }
+
+
+def report(result):
+    print "requests %d in %.1fs, %d connection errors" % (result["requests"], result["seconds"], result["errors"])
+    print "codes    %s" % ", ".join("%s: %d" % item for item in sorted(result["codes"].items()))
+    print "rps      %.0f" % result["rps"]
+    print "latency  p50 %.2fms  p95 %.2fms  p99 %.2fms  max %.2fms" % tuple(
+        result[name] * 1000 for name in ("p50", "p95", "p99", "max"))
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-u", "--url", action="store", default="http://localhost:8080/method/")
+    op.add_option("-c", "--corpus", action="store", default=None,
+                  help="JSONL file of method requests, a synthetic corpus by default")
+    op.add_option("--sign", action="store_true", default=False, help="replace tokens of the corpus with valid ones")
+    op.add_option("-n", "--concurrency", action="store", type=int, default=8)
+    op.add_option("-d", "--duration", action="store", type=float, default=10)
+    op.add_option("-r", "--requests", action="store", type=int, default=None,
+                  help="stop after this many requests, before --duration")
+    op.add_option("--rate", action="store", type=float, default=None,
+                  help="requests per second of all connections together, as fast as possible by default")
+    op.add_option("-s", "--seed", action="store", type=int, default=42)
+    op.add_option("--corpus-size", action="store", type=int, default=1000)
+    op.add_option("--local", action="store_true", default=False,
+                  help="start the server in-process on an in-memory store")
+    op.add_option("-t", "--threads", action="store", type=int, default=8,
+                  help="thread pool size of the --local server, 0 for a serial server")
+    op.add_option("--save", action="store", default=None, help="write results to a JSON file")
+    (opts, args) = op.parse_args()
+
+    if opts.corpus:
+        corpus = read_corpus(opts.corpus)
+        if opts.sign:
+            corpus = [sign(body) for body in corpus]
+    else:
+        corpus = synthetic_corpus(opts.corpus_size, opts.seed)
+    if not corpus:
+        sys.exit("No method requests in %s" % opts.corpus)
+    url = opts.url
+    if opts.local:
+        server = start_local_server(opts.threads, opts.seed)
+        url = "http://localhost:%d/method/" % server.server_address[1]
+    result = run(url, corpus, opts.concurrency, opts.duration, opts.requests, opts.rate)
+    if opts.local:
+        server.shutdown()
+        server.server_close()
+    report(result)
+    if opts.save:
+        with open(opts.save, "w") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,175 @@
+"""Micro-benchmarks of request validation.
+
+Times every `Field` subclass with valid and invalid values and whole
+requests from a JSONL corpus of method requests (a seeded synthetic
+corpus by default). Reports operations per second, best of `--repeat`
+runs.
+
+    python -m benchmarks.validation
+    python -m benchmarks.validation --corpus requests.jsonl --save base.json
+    python -m benchmarks.validation --compare base.json
+"""
+import json
+import random
+import sys
+import timeit
+from optparse import OptionParser
+
+import api
+
+
+FIELD_CASES = [
+    ("CharField", api.CharField, "name", 12),
+    ("EmailField", api.EmailField, "name@mail.ru", "name@mailru"),
+    ("PhoneField", api.PhoneField, "79175002040", "89175002040"),
+    ("PhoneField int", api.PhoneField, 79175002040, 99175002040),
+    ("DateField", api.DateField, "20.07.2017", "20/07/2017"),
+    ("BirthDayField", api.BirthDayField, "01.01.1990", "01.01.1890"),
+    ("GenderField", api.GenderField, 1, 3),
+    ("ClientIDsField", api.ClientIDsField, [1, 2, 3, 4], [1, "2"]),
+]
+
+ARGUMENTS = {
+    "online_score": {
+        "phone": ["79175002040", 79175002040, "89175002040", None],
+        "email": ["fake@mail.ru", "fakemail.ru", None],
+        "first_name": ["Niels", 1, None],
+        "last_name": ["Bohr", None],
+        "birthday": ["01.01.1990", "01.01.1890", "XXX", None],
+        "gender": [0, 1, 2, 3, None],
+    },
+    "clients_interests": {
+        "client_ids": [[1, 2, 3, 4], [0], [], ["1"], None],
+        "date": ["20.07.2017", "XXX", None],
+    },
+}
+
+ARGUMENTS_FULL = {"phone": "79175002040", "email": "fake@mail.ru", "first_name": "Niels",
+                  "last_name": "Bohr", "birthday": "01.01.1990", "gender": 1}
+
+REQUEST_CLASSES = {
+    "online_score": api.OnlineScoreRequest,
+    "clients_interests": api.ClientsInterestsRequest,
+}
+
+
+def synthetic_corpus(size, seed):
+    rnd = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        method = rnd.choice(sorted(ARGUMENTS))
+        arguments = {}
+        for name, values in sorted(ARGUMENTS[method].items()):
+            value = rnd.choice(values)
+            if value is not None:
+                arguments[name] = value
+        corpus.append({"account": "horns&hoofs", "login": rnd.choice(["h&f", "admin"]),
+                       "method": method, "token": "token", "arguments": arguments})
+    return corpus
+
+
+def read_corpus(path):
+    """Method requests of a JSONL file; other lines are skipped."""
+    corpus = []
+    with open(path) as f:
+        for line in f:
+            try:
+                body = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(body, dict) and "body" in body and isinstance(body["body"], dict):
+                body = body["body"]
+            if isinstance(body, dict) and "method" in body and "arguments" in body:
+                corpus.append(body)
+    return corpus
+
+
+def validate(body):
+    method_request = api.MethodRequest(body)
+    method_request.valid_required_field()
+    request_class = REQUEST_CLASSES.get(method_request.method)
+    if request_class and isinstance(method_request.arguments, dict):
+        request = request_class(method_request.arguments)
+        request.valid_required_field()
+
+
+def field_benchmarks():
+    for name, field_class, valid, invalid in FIELD_CASES:
+        field = field_class()
+
+        def run_valid(field=field, value=valid):
+            field.valid_value(value)
+
+        def run_invalid(field=field, value=invalid):
+            try:
+                field.valid_value(value)
+            except api.ValidationError:
+                pass
+
+        yield "%s valid" % name, run_valid, 1
+        yield "%s invalid" % name, run_invalid, 1
+
+
+def request_benchmarks(corpus):
+    valid = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "token",
+             "arguments": {"phone": "79175002040", "email": "fake@mail.ru"}}
+    yield "MethodRequest valid", lambda: api.MethodRequest(valid).valid_required_field(), 1
+    yield "MethodRequest invalid", lambda: api.MethodRequest({}).valid_required_field(), 1
+    yield "OnlineScoreRequest", lambda: api.OnlineScoreRequest(
+        ARGUMENTS_FULL).valid_required_field(), 1
+    yield "ClientsInterestsRequest", lambda: api.ClientsInterestsRequest(
+        {"client_ids": [1, 2, 3, 4], "date": "20.07.2017"}).valid_required_field(), 1
+
+    def run_corpus(items=corpus):
+        for body in items:
+            validate(body)
+
+    yield "corpus request (%d)" % len(corpus), run_corpus, len(corpus)
+
+
+def run(benchmarks, number, repeat):
+    """Times every benchmark; `weight` operations are made per call."""
+    results = []
+    for name, func, weight in benchmarks:
+        calls = max(number / weight, 1)
+        func()
+        best = min(timeit.repeat(func, number=calls, repeat=repeat))
+        results.append({"name": name, "ops": calls * weight / best})
+    return results
+
+
+def report(results, baseline=None):
+    baseline = dict((r["name"], r["ops"]) for r in baseline or [])
+    print "%-32s %14s %10s" % ("benchmark", "ops/sec", "change")
+    for r in results:
+        change = ""
+        if r["name"] in baseline:
+            change = "%+.1f%%" % ((r["ops"] / baseline[r["name"]] - 1) * 100)
+        print "%-32s %14.0f %10s" % (r["name"], r["ops"], change)
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-c", "--corpus", action="store", default=None,
+                  help="JSONL file of method requests, a synthetic corpus by default")
+    op.add_option("-n", "--number", action="store", type=int, default=10000)
+    op.add_option("-r", "--repeat", action="store", type=int, default=5)
+    op.add_option("-s", "--seed", action="store", type=int, default=42)
+    op.add_option("--corpus-size", action="store", type=int, default=100)
+    op.add_option("--save", action="store", default=None, help="write results to a JSON file")
+    op.add_option("--compare", action="store", default=None, help="compare with results saved by --save")
+    (opts, args) = op.parse_args()
+
+    corpus = read_corpus(opts.corpus) if opts.corpus else synthetic_corpus(opts.corpus_size, opts.seed)
+    if not corpus:
+        sys.exit("No method requests in %s" % opts.corpus)
+    benchmarks = list(field_benchmarks()) + list(request_benchmarks(corpus))
+    results = run(benchmarks, opts.number, opts.repeat)
+    baseline = None
+    if opts.compare:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if opts.save:
+        with open(opts.save, "w") as f:
+            json.dump(results, f, indent=2)
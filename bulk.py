@@ -0,0 +1,119 @@
+"""Scoring of columnar applicant batches.
+
+`score_columns` takes one list per `OnlineScoreRequest` field, validates
+every column with the rules of that field and scores the valid rows in
+chunks: one pipelined cache read and one cache write per chunk. Rows
+that fail validation get the error the API would answer with instead
+of a score.
+
+    scores, errors = score_columns(store, {"phone": [...], "email": [...]})
+"""
+from api import OnlineScoreRequest, ValidationError, EMPTY_VALUES
+import scoring
+from scoring import SCORE_EXPIRE, get_score_key
+
+
+FIELDS = ("phone", "email", "birthday", "gender", "first_name", "last_name")
+CHUNK_SIZE = 1000
+
+
+def validate_column(name, column, errors):
+    """Valid values of `column`, `None` for missing and invalid ones.
+
+    Error messages are put in `errors[row][name]`.
+    """
+    field = OnlineScoreRequest.declared_defs[name]
+    valid_value = field.valid_value
+    values = []
+    for row, value in enumerate(column):
+        if value is None:
+            values.append(None)
+            continue
+        try:
+            if not field.nullable and value in EMPTY_VALUES:
+                raise ValidationError('This field cannot be empty.')
+            values.append(valid_value(value))
+        except ValidationError, e:
+            errors.setdefault(row, {})[name] = e.args[0]
+            values.append(None)
+    return values
+
+
+def validate_columns(columns):
+    """Validates `columns` like `api.validate_online_score` validates one request.
+
+    Returns the valid columns, all of `FIELDS`, and the error message of
+    every invalid row by row number.
+    """
+    unknown = set(columns) - set(FIELDS)
+    if unknown:
+        raise ValueError("Unknown columns: %s" % ", ".join(sorted(unknown)))
+    sizes = set(len(column) for column in columns.values())
+    if len(sizes) > 1:
+        raise ValueError("Columns differ in length: %s" % ", ".join(
+            "%s=%d" % (name, len(column)) for name, column in sorted(columns.items())))
+    size = sizes.pop() if sizes else 0
+    errors = {}
+    valid = dict((name, validate_column(name, columns[name], errors) if name in columns else [None] * size)
+                 for name in FIELDS)
+    messages = dict((row, "<Invalid fields: %s>" % fields) for row, fields in errors.items())
+
+    phone, email, birthday, gender = valid["phone"], valid["email"], valid["birthday"], valid["gender"]
+    first_name, last_name = valid["first_name"], valid["last_name"]
+    for row in xrange(size):
+        if row in messages:
+            continue
+        if not (phone[row] and email[row] or first_name[row] and last_name[row] or gender[row] and birthday[row]):
+            messages[row] = "<Invalid fields: %s>" % [
+                name for name in columns if columns[name][row] is not None and not valid[name][row]]
+    return valid, messages
+
+
+def chunk_scores(store, scorer, columns, deadline=None):
+    """Scores of the rows of valid `columns` with one cache read and write."""
+    size = len(columns["phone"])
+
+    def compute(rows):
+        return [scorer.func(*[columns[name][row] for name in FIELDS]) for row in rows]
+
+    if scorer.inline and not scorer.cache_writes:
+        return compute(xrange(size))
+    keys = [get_score_key(phone, birthday, first_name, last_name) for phone, birthday, first_name, last_name
+            in zip(columns["phone"], columns["birthday"], columns["first_name"], columns["last_name"])]
+    if scorer.inline:
+        scores = compute(xrange(size))
+        store.cache_set_many(dict(zip(keys, scores)).items(), SCORE_EXPIRE, deadline=deadline)
+        return scores
+
+    cached = store.cache_get_many(keys, deadline=deadline) or [None] * size
+    scores = [float(value or 0) for value in cached]
+    missed = [row for row, score in enumerate(scores) if not score]
+    if missed:
+        computed = {}
+        for row, score in zip(missed, compute(missed)):
+            scores[row] = computed[keys[row]] = score
+        # cache for 60 minutes
+        store.cache_set_many(computed.items(), SCORE_EXPIRE, deadline=deadline)
+    return scores
+
+
+def score_columns(store, columns, chunk_size=CHUNK_SIZE, scorer=None, deadline=None):
+    """Scores the applicants of `columns`, a dict of equally long lists by field name.
+
+    Returns a list of scores and a list of error messages, both by row:
+    a row has either a score or an error. Scores are read and written
+    through the cache like `scoring.SCORER` (or `scorer`) does, in
+    chunks of `chunk_size` valid rows. Raises `ValueError` if a column
+    is unknown or the columns differ in length.
+    """
+    scorer = scorer or scoring.SCORER
+    valid, messages = validate_columns(columns)
+    size = len(valid["phone"])
+    scores = [None] * size
+    rows = [row for row in xrange(size) if row not in messages]
+    for start in xrange(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        chunk_columns = dict((name, [valid[name][row] for row in chunk]) for name in FIELDS)
+        for row, score in zip(chunk, chunk_scores(store, scorer, chunk_columns, deadline)):
+            scores[row] = score
+    return scores, [messages.get(row) for row in xrange(size)]
@@ -0,0 +1,59 @@
+"""JSON codecs of request and response bodies.
+
+`get_codec` returns the codec of a backend by name, "auto" picks the
+fastest installed one. `ujson` and `simplejson` are optional, a backend
+that is not installed falls back to the stdlib `json`.
+"""
+import json
+import logging
+from functools import partial
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+
+class Codec(object):
+    """`loads` and `dumps` of one JSON backend.
+
+    `dumps` returns a byte string ready to be written to a socket.
+    """
+
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+    def __repr__(self):
+        return "Codec(%s)" % self.name
+
+
+def _backends():
+    backends = {"json": Codec("json", json.loads, json.dumps)}
+    if ujson is not None:
+        backends["ujson"] = Codec("ujson", ujson.loads, partial(ujson.dumps, escape_forward_slashes=False))
+    if simplejson is not None:
+        backends["simplejson"] = Codec("simplejson", simplejson.loads, simplejson.dumps)
+    return backends
+
+BACKENDS = _backends()
+NAMES = ("auto", "ujson", "simplejson", "json")
+
+
+def get_codec(name="auto"):
+    if name not in NAMES:
+        raise ValueError("Unknown JSON codec %r, expected one of %s" % (name, ", ".join(NAMES)))
+    if name == "auto":
+        for name in NAMES[1:]:
+            if name in BACKENDS:
+                return BACKENDS[name]
+    if name not in BACKENDS:
+        logging.warning("JSON codec %s is not installed, using json" % name)
+        return BACKENDS["json"]
+    return BACKENDS[name]
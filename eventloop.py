@@ -0,0 +1,228 @@
+import asyncore
+import collections
+import heapq
+import sys
+import time
+import types
+from functools import wraps
+
+
+class Future(object):
+    """Result of an operation that has not completed yet.
+
+    Callbacks added with `add_done_callback` are called with the future
+    as soon as its result or exception is set. Only the first result or
+    exception set is kept.
+    """
+
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self):
+        return self._exc_info[1] if self._exc_info else None
+
+    def exc_info(self):
+        return self._exc_info
+
+    def set_result(self, result):
+        if self._done:
+            return
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exception):
+        self.set_exc_info((type(exception), exception, None))
+
+    def set_exc_info(self, exc_info):
+        if self._done:
+            return
+        self._exc_info = exc_info
+        self._finish()
+
+    def add_done_callback(self, callback):
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _finish(self):
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+def resolved(result=None):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def gather(futures):
+    """Future of the list of results of all `futures`."""
+    result = Future()
+    futures = [f if isinstance(f, Future) else resolved(f) for f in futures]
+    if not futures:
+        result.set_result([])
+        return result
+    remaining = [len(futures)]
+
+    def on_done(_):
+        remaining[0] -= 1
+        if remaining[0] or result.done():
+            return
+        for future in futures:
+            if future.exc_info():
+                result.set_exc_info(future.exc_info())
+                return
+        result.set_result([future.result() for future in futures])
+
+    for future in futures:
+        future.add_done_callback(on_done)
+    return result
+
+
+class Return(Exception):
+    """Raised by a coroutine to return a value."""
+
+    def __init__(self, value=None):
+        super(Return, self).__init__()
+        self.value = value
+
+
+def coroutine(func):
+    """Turns a generator yielding futures into a function returning a future.
+
+    The generator receives the result of every yielded future (a list of
+    futures is gathered) and returns its value with `raise Return(value)`.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        result = Future()
+        try:
+            gen = func(*args, **kwargs)
+        except Return, e:
+            result.set_result(e.value)
+            return result
+        except Exception:
+            result.set_exc_info(sys.exc_info())
+            return result
+        if not isinstance(gen, types.GeneratorType):
+            result.set_result(gen)
+            return result
+        _step(gen, result, None)
+        return result
+    return wrapper
+
+
+def _step(gen, result, future):
+    while True:
+        try:
+            if future is None:
+                yielded = gen.send(None)
+            elif future.exc_info():
+                yielded = gen.throw(*future.exc_info())
+            else:
+                yielded = gen.send(future.result())
+        except Return, e:
+            result.set_result(e.value)
+            return
+        except StopIteration:
+            result.set_result(None)
+            return
+        except Exception:
+            result.set_exc_info(sys.exc_info())
+            return
+        if isinstance(yielded, (list, tuple)):
+            yielded = gather(yielded)
+        elif not isinstance(yielded, Future):
+            yielded = resolved(yielded)
+        if not yielded.done():
+            yielded.add_done_callback(lambda f: _step(gen, result, f))
+            return
+        future = yielded
+
+
+class Timer(object):
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+
+class EventLoop(object):
+    """Single threaded loop over `asyncore` channels with timers.
+
+    Channels register in `self.map`; callbacks and timers run between
+    polls of the sockets.
+    """
+
+    def __init__(self, poll_interval=1.0):
+        self.map = {}
+        self.poll_interval = poll_interval
+        self.ready = collections.deque()
+        self.timers = []
+        self.running = False
+
+    def time(self):
+        return time.time()
+
+    def call_soon(self, callback, *args):
+        self.ready.append((callback, args))
+
+    def call_later(self, delay, callback, *args):
+        timer = Timer(self.time() + delay, callback, args)
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def stop(self):
+        self.running = False
+
+    def run_once(self):
+        while self.ready:
+            callback, args = self.ready.popleft()
+            callback(*args)
+        now = self.time()
+        while self.timers and (self.timers[0].cancelled or self.timers[0].when <= now):
+            timer = heapq.heappop(self.timers)
+            if not timer.cancelled:
+                timer.callback(*timer.args)
+        if self.ready:
+            timeout = 0
+        elif self.timers:
+            timeout = min(max(self.timers[0].when - self.time(), 0), self.poll_interval)
+        else:
+            timeout = self.poll_interval
+        if self.map:
+            asyncore.loop(timeout, True, self.map, 1)
+        elif timeout:
+            time.sleep(timeout)
+
+    def run_forever(self):
+        self.running = True
+        while self.running:
+            self.run_once()
+
+    def run_until_complete(self, future):
+        future.add_done_callback(lambda _: self.stop())
+        if not future.done():
+            self.run_forever()
+        return future.result()
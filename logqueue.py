@@ -0,0 +1,125 @@
+"""Logging off the request path.
+
+`QueueHandler` only puts records on a queue, a background thread
+formats them and writes them in batches to the stream of the wrapped
+handler. `JSONFormatter` writes every record as one JSON line.
+"""
+import json
+import logging
+import os
+import threading
+import Queue
+
+
+FORMAT = '[%(asctime)s] %(levelname).1s %(message)s'
+DATEFMT = '%Y.%m.%d %H:%M:%S'
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as a JSON object with the `FIELDS` passed in `extra`."""
+
+    FIELDS = ("request_id", "path", "code", "timings")
+
+    def format(self, record):
+        data = {"time": self.formatTime(record, self.datefmt), "level": record.levelname,
+                "message": record.getMessage()}
+        for name in self.FIELDS:
+            if name in record.__dict__:
+                data[name] = record.__dict__[name]
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data)
+
+
+class QueueHandler(logging.Handler):
+    """Hands records to a thread that writes them with `handler`.
+
+    Records are formatted by the writer thread, so their arguments
+    must not change after the logging call. When `size` records wait
+    in the queue new ones are dropped and counted in `dropped`. The
+    writer is started by the first record of every process, so the
+    handler survives `fork`. `close` writes the records left.
+    """
+
+    def __init__(self, handler, size=10000, batch=512):
+        logging.Handler.__init__(self)
+        self.handler = handler
+        self.size = size
+        self.batch = batch
+        self.dropped = 0
+        self.pid = None
+        self.queue = None
+        self.thread = None
+
+    def start(self):
+        self.pid = os.getpid()
+        self.queue = Queue.Queue(self.size)
+        self.thread = threading.Thread(target=self.write_records, args=(self.queue,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def write_records(self, queue):
+        while True:
+            records = [queue.get()]
+            while len(records) < self.batch:
+                try:
+                    records.append(queue.get_nowait())
+                except Queue.Empty:
+                    break
+            self.write([record for record in records if record is not None])
+            if None in records:
+                return
+
+    def write(self, records):
+        handler = self.handler
+        lines = []
+        for record in records:
+            if record.levelno < handler.level or not handler.filter(record):
+                continue
+            try:
+                line = handler.format(record)
+                if isinstance(line, unicode):
+                    line = line.encode('utf-8')
+                lines.append(line + '\n')
+            except Exception:
+                handler.handleError(record)
+        if not lines:
+            return
+        handler.acquire()
+        try:
+            handler.stream.write(''.join(lines))
+            handler.flush()
+        except Exception:
+            handler.handleError(records[-1])
+        finally:
+            handler.release()
+
+    def close(self):
+        if self.pid == os.getpid() and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.handler.close()
+        logging.Handler.close(self)
+
+
+def setup_logging(filename=None, json_lines=False, queue_size=0, level=logging.INFO):
+    """Logs to `filename` or stderr, through a `QueueHandler` if `queue_size` is set."""
+    handler = logging.FileHandler(filename) if filename else logging.StreamHandler()
+    if json_lines:
+        handler.setFormatter(JSONFormatter(datefmt=DATEFMT))
+    else:
+        handler.setFormatter(logging.Formatter(FORMAT, DATEFMT))
+    if queue_size:
+        handler = QueueHandler(handler, queue_size)
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
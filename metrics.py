@@ -0,0 +1,148 @@
+"""Counters, gauges and histograms in the Prometheus text format.
+
+Every thread updates its own shard of values, so updates take no lock
+and lose no increments; `Registry.render` sums the shards. Values are
+kept per process, every pre-forked worker exposes its own.
+"""
+import bisect
+import threading
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+        self.shards = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = {}
+            with self.lock:
+                self.shards.append(shard)
+            return shard
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(self, name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.add(Gauge(self, name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(self, name, help, labels, buckets))
+
+    def collect(self):
+        """Sum of the values of all threads by key."""
+        values = {}
+        for shard in list(self.shards):
+            for key, value in shard.copy().iteritems():
+                values[key] = values.get(key, 0) + value
+        return values
+
+    def reset(self):
+        for shard in list(self.shards):
+            shard.clear()
+
+    def render(self):
+        values = self.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.help))
+            lines.append("# TYPE %s %s" % (metric.name, metric.type))
+            lines.extend(metric.render(values))
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(names, values, extra=()):
+    pairs = zip(names, values) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, str(value).replace("\\", r"\\").replace('"', r'\"')
+                                                .replace("\n", r"\n")) for name, value in pairs)
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """Value that only grows, one per tuple of label values."""
+
+    type = "counter"
+
+    def __init__(self, registry, name, help, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def inc(self, labels=(), value=1):
+        shard = self.registry.shard()
+        key = (self.name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def value(self, labels=()):
+        return self.registry.collect().get((self.name, labels), 0)
+
+    def render(self, values):
+        return ["%s%s %s" % (self.name, format_labels(self.labels, key[1]), format_value(value))
+                for key, value in sorted(values.iteritems()) if key[0] == self.name]
+
+
+class Gauge(Counter):
+    """Value that goes up and down, like requests in progress."""
+
+    type = "gauge"
+
+    def dec(self, labels=(), value=1):
+        self.inc(labels, -value)
+
+
+class Histogram(object):
+    """Counts of observed values by `buckets` upper bounds, their sum and count."""
+
+    type = "histogram"
+
+    def __init__(self, registry, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        shard = self.registry.shard()
+        key = (self.name, labels, bisect.bisect_left(self.buckets, value))
+        shard[key] = shard.get(key, 0) + 1
+        key = (self.name, labels, "sum")
+        shard[key] = shard.get(key, 0) + value
+
+    def render(self, values):
+        series = {}
+        for key, value in values.iteritems():
+            if key[0] == self.name:
+                series.setdefault(key[1], {})[key[2]] = value
+        lines = []
+        bounds = [format_value(float(bound)) for bound in self.buckets] + ["+Inf"]
+        for labels, counts in sorted(series.iteritems()):
+            total = 0
+            for index, bound in enumerate(bounds):
+                total += counts.get(index, 0)
+                lines.append("%s_bucket%s %d" % (
+                    self.name, format_labels(self.labels, labels, [("le", bound)]), total))
+            lines.append("%s_sum%s %s" % (self.name, format_labels(self.labels, labels),
+                                           format_value(float(counts.get("sum", 0)))))
+            lines.append("%s_count%s %d" % (self.name, format_labels(self.labels, labels), total))
+        return lines
+
+
+METRICS = Registry()
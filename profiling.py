@@ -0,0 +1,118 @@
+"""Timing of request stages and sampled profiling of whole requests.
+
+Stages are timed only when the request context holds a `Timings`, so
+requests without it pay one dict lookup per stage. `Profiler` runs a
+share of requests under cProfile and sums their statistics until they
+are dumped.
+"""
+import cProfile
+import logging
+import os
+import pstats
+import random
+import signal
+import threading
+import time
+
+
+class Timings(dict):
+    """Seconds spent in every stage of a request, summed by stage name."""
+
+    def format(self):
+        return " ".join("%s=%.2fms" % (name, seconds * 1000) for name, seconds in sorted(self.items()))
+
+
+class Stage(object):
+    __slots__ = ('timings', 'name', 'started')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.time()
+
+    def __exit__(self, *exc_info):
+        self.timings[self.name] = self.timings.get(self.name, 0) + time.time() - self.started
+
+
+class NoStage(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+NO_STAGE = NoStage()
+
+
+def stage(ctx, name):
+    """Context manager adding its run time to `ctx['timings'][name]`, if there are timings."""
+    timings = ctx.get('timings') if ctx is not None else None
+    if timings is None:
+        return NO_STAGE
+    return Stage(timings, name)
+
+
+class TimedStore(object):
+    """Store proxy adding the time of every call to the "store" stage."""
+
+    def __init__(self, store, timings):
+        self.store = store
+        self.timings = timings
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+        if not callable(method):
+            return method
+
+        def timed(*args, **kwargs):
+            with Stage(self.timings, "store"):
+                return method(*args, **kwargs)
+        return timed
+
+
+class Profiler(object):
+    """Profiles `rate` of the calls of `runcall` with cProfile.
+
+    Statistics of the sampled calls are summed and written to
+    `output` with the process id appended by `dump`, on SIGUSR1 once
+    `install` is called.
+    """
+
+    def __init__(self, rate, output="api.prof"):
+        self.rate = rate
+        self.output = output
+        self.stats = None
+        self.samples = 0
+        self.lock = threading.Lock()
+
+    def sample(self):
+        return random.random() < self.rate
+
+    def runcall(self, func, *args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            with self.lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+                self.samples += 1
+
+    def dump(self):
+        path = "%s.%d" % (self.output, os.getpid())
+        with self.lock:
+            if self.stats is None:
+                logging.info("No sampled requests to profile")
+                return None
+            self.stats.dump_stats(path)
+            logging.info("Profile of %s sampled requests written to %s" % (self.samples, path))
+        return path
+
+    def install(self, signum=signal.SIGUSR1):
+        # The dump runs in its own thread: the signal may arrive while
+        # the main thread holds the lock in `runcall`.
+        signal.signal(signum, lambda signum, frame: threading.Thread(target=self.dump).start())
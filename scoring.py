@@ -1,21 +1,44 @@
 import hashlib
 import json
+import sys
+import threading
 from datetime import datetime
+from metrics import METRICS
 from store import Store, RedisStore
 
-def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+SCORE_EXPIRE = 60 * 60
+SINGLE_FLIGHT = METRICS.counter(
+    "scoring_single_flight_total", "Score lookups by role: a leader reads and computes, a follower shares its result, "
+    "timeout counts followers that computed on their own past their deadline",
+    ("role",))
+
+
+def get_score_key(phone, birthday=None, first_name=None, last_name=None):
     key_parts = [
         first_name or "",
         last_name or "",
         str(phone) if phone else "",
         birthday.strftime("%Y%m%d") if birthday is not None else "",
     ]
-    key = "uid:" + hashlib.md5("".join(key_parts)).hexdigest()
-    # try get from cache,
-    # fallback to heavy calculation in case of cache miss
-    score = float(store.cache_get(key) or 0)
-    if score:
-        return score
+    return "uid:" + hashlib.md5("".join(key_parts)).hexdigest()
+
+
+CHEAP = "cheap"
+EXPENSIVE = "expensive"
+MODES = ("cache", "inline", "auto")
+
+
+def cost(value):
+    """Declares the cost of a scoring function, `CHEAP` or `EXPENSIVE`."""
+    def decorator(func):
+        func.cost = value
+        return func
+    return decorator
+
+
+@cost(CHEAP)
+def calc_score(phone=None, email=None, birthday=None, gender=None, first_name=None, last_name=None):
+    score = 0.0
     if phone:
         score += 1.5
     if email:
@@ -24,11 +47,158 @@ def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
         score += 1.5
     if first_name and last_name:
         score += 0.5
-    # cache for 60 minutes
-    store.cache_set(key, score, 60 * 60)
     return score
 
 
-def get_interests(store, cid):
-    r = store.get("i:%s" % cid)
+class Flight(object):
+    __slots__ = ('done', 'result', 'exc_info')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """Runs one call per key at a time.
+
+    A caller of `do` with a key already running waits for that call
+    and gets its result or exception instead of running `func` again.
+    A follower given a `deadline` waits until it expires at most and
+    then returns `fallback(*args)` instead.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, func, args=(), deadline=None, fallback=None):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+        if not leader:
+            SINGLE_FLIGHT.inc(("follower",))
+            if not flight.done.wait(deadline.remaining() if deadline is not None else None):
+                SINGLE_FLIGHT.inc(("timeout",))
+                return fallback(*args)
+            if flight.exc_info:
+                raise flight.exc_info[0], flight.exc_info[1], flight.exc_info[2]
+            return flight.result
+        SINGLE_FLIGHT.inc(("leader",))
+        try:
+            flight.result = func(*args)
+            return flight.result
+        except Exception:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+
+class Scorer(object):
+    """Scores applicants with `func`.
+
+    In "cache" mode scores are read through the store: a cached score
+    is returned, a missing one is computed and cached for an hour. In
+    "inline" mode the score is computed on every call without a cache
+    read, for functions cheaper than a store round trip; scores are
+    still written to the cache if `cache_writes` is set. "auto" picks
+    "inline" for functions declared `CHEAP` with `cost`.
+
+    With `single_flight` concurrent `score` calls of the same cache key
+    share one cache read and one computation.
+    """
+
+    def __init__(self, func=calc_score, mode="cache", cache_writes=False, single_flight=False):
+        self.func = func
+        self.inline = mode == "inline" or mode == "auto" and getattr(func, "cost", EXPENSIVE) == CHEAP
+        self.cache_writes = cache_writes
+        self.flights = SingleFlight() if single_flight else None
+
+    def score(self, store, phone, email, birthday=None, gender=None, first_name=None, last_name=None,
+              deadline=None):
+        if self.inline:
+            score = self.func(phone, email, birthday, gender, first_name, last_name)
+            if self.cache_writes:
+                key = get_score_key(phone, birthday, first_name, last_name)
+                store.cache_set(key, score, SCORE_EXPIRE, deadline=deadline)
+            return score
+        key = get_score_key(phone, birthday, first_name, last_name)
+        applicant = (phone, email, birthday, gender, first_name, last_name)
+        if self.flights is not None:
+            # A follower out of time computes the score without the cache.
+            return self.flights.do(key, self.read_through, (store, key, applicant, deadline), deadline,
+                                   lambda store, key, applicant, deadline: self.func(*applicant))
+        return self.read_through(store, key, applicant, deadline)
+
+    def read_through(self, store, key, applicant, deadline=None):
+        # try get from cache,
+        # fallback to heavy calculation in case of cache miss
+        score = float(store.cache_get(key, deadline=deadline) or 0)
+        if score:
+            return score
+        score = self.func(*applicant)
+        # cache for 60 minutes
+        store.cache_set(key, score, SCORE_EXPIRE, deadline=deadline)
+        return score
+
+    def keys(self, applicants):
+        return [get_score_key(a.get("phone"), a.get("birthday"), a.get("first_name"), a.get("last_name"))
+                for a in applicants]
+
+    def score_many(self, store, applicants, deadline=None):
+        if self.inline:
+            scores = [self.func(**applicant) for applicant in applicants]
+            if self.cache_writes and applicants:
+                store.cache_set_many(dict(zip(self.keys(applicants), scores)).items(), SCORE_EXPIRE,
+                                     deadline=deadline)
+            return scores
+        keys = self.keys(applicants)
+        cached = store.cache_get_many(keys, deadline=deadline) if keys else []
+        scores, missed = [], {}
+        for key, value, applicant in zip(keys, cached or [None] * len(keys), applicants):
+            score = float(value or 0) or missed.get(key)
+            if not score:
+                score = missed[key] = self.func(**applicant)
+            scores.append(score)
+        if missed:
+            # cache for 60 minutes
+            store.cache_set_many(missed.items(), SCORE_EXPIRE, deadline=deadline)
+        return scores
+
+
+SCORER = Scorer()
+
+
+def load_scorer(path):
+    """Scoring function of a "module:function" path."""
+    module, _, name = path.partition(":")
+    return getattr(__import__(module, fromlist=[name]), name)
+
+
+def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None,
+              deadline=None):
+    return SCORER.score(store, phone, email, birthday, gender, first_name, last_name, deadline)
+
+
+def get_scores(store, applicants, deadline=None):
+    """Scores every applicant like `get_score` in two store round trips.
+
+    `applicants` is a list of dicts with `get_score` keyword arguments.
+    """
+    return SCORER.score_many(store, applicants, deadline)
+
+
+def get_interests(store, cid, deadline=None):
+    r = store.get("i:%s" % cid, deadline=deadline)
     return json.loads(r) if r else []
+
+
+def get_interests_many(store, cids, deadline=None):
+    """Gets interests of all `cids` with a single store round trip."""
+    values = store.get_many(["i:%s" % cid for cid in cids], deadline=deadline)
+    return [json.loads(r) if r else [] for r in values]
@@ -1,31 +1,128 @@
 import redis
+import os
 import time
-from redis.exceptions import TimeoutError, ConnectionError
-from functools import wraps
+import random
+import socket
+import struct
+import bisect
+import hashlib
+import asyncore
+import collections
+import heapq
+import threading
+from multiprocessing.pool import ThreadPool
+from redis.exceptions import TimeoutError, ConnectionError, ResponseError
+from eventloop import Future, resolved
+from metrics import METRICS
 
 
-def connection_attempt(exceptions, tries=3, timeout=0.2):
-    def decorator(f):
-        @wraps(f)
-        def wrapper(*args, **kwargs):
-            for _ in range(tries):
-                try:
-                    return f(*args, **kwargs)
-                except exceptions:
-                    time.sleep(timeout)
-        return wrapper
-    return decorator
+STORE_ERRORS = (TimeoutError, ConnectionError)
+STORE_RESULTS = METRICS.counter(
+    "scoring_store_results_total", "Outcomes of Store calls, keys of bulk reads are counted one by one",
+    ("op", "result"))
+STORE_RETRIES = METRICS.counter(
+    "scoring_store_retries_total", "Backend calls repeated after a connection error or timeout", ("op",))
+LOCAL_CACHE = METRICS.counter(
+    "scoring_local_cache_total", "Local cache lookups by cache and result (hit, miss) and evicted keys (eviction)",
+    ("cache", "result"))
+WRITE_BEHIND = METRICS.counter(
+    "scoring_write_behind_total", "Cache writes by outcome: queued, coalesced, dropped, written, failed",
+    ("result",))
+
+
+class RetryPolicy(object):
+    """Exponential backoff with full jitter.
+
+    Allows up to `tries` attempts. The pause before the next attempt is
+    random in `[0, min(cap, base * 2 ** n)]`, and the pauses together
+    never exceed `budget` seconds.
+    """
+
+    def __init__(self, tries=3, base=0.05, cap=0.2, budget=None):
+        self.tries = tries
+        self.base = base
+        self.cap = cap
+        self.budget = budget
+
+    def delays(self):
+        spent = 0.0
+        for attempt in range(self.tries - 1):
+            delay = random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+            if self.budget is not None and spent + delay > self.budget:
+                return
+            spent += delay
+            yield delay
+
+
+class CircuitBreaker(object):
+    """Stops calls to a failing backend.
+
+    Opens after `threshold` failed calls in a row. While open, `allow`
+    is false; after `reset_timeout` seconds a single trial call is let
+    through and its outcome closes or reopens the breaker.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=5):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        with self.lock:
+            if time.time() - self.opened_at < self.reset_timeout:
+                return False
+            self.opened_at = time.time()
+            return True
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.time()
 
 
 class RedisStore(object):
-    def __init__(self, host='localhost', db=None, port=6379, timeout=None):
-        self.redis_base = redis.Redis(
-            host=host,
-            port=port,
-            db=db or 0,
-            socket_timeout=timeout,
-            socket_connect_timeout=timeout,
-            decode_responses=True)
+    """Redis backend of `Store`.
+
+    Connections come from a pool shared by all threads using the store.
+    With `max_connections` the pool is bounded and a thread waits up to
+    `pool_timeout` seconds for a free connection. `unix_socket` replaces
+    `host` and `port` with the path of a Unix domain socket.
+    """
+
+    def __init__(self, host='localhost', db=None, port=6379, timeout=None, connect_timeout=None,
+                 max_connections=None, pool_timeout=20, keepalive=False, unix_socket=None):
+        options = {
+            "db": db or 0,
+            "socket_timeout": timeout,
+            "decode_responses": True,
+        }
+        if unix_socket:
+            options.update(path=unix_socket, connection_class=redis.UnixDomainSocketConnection)
+        else:
+            options.update(
+                host=host,
+                port=port,
+                socket_connect_timeout=timeout if connect_timeout is None else connect_timeout,
+                socket_keepalive=keepalive)
+        if max_connections:
+            self.pool = redis.BlockingConnectionPool(
+                max_connections=max_connections, timeout=pool_timeout, **options)
+        else:
+            self.pool = redis.ConnectionPool(**options)
+        self.redis_base = redis.Redis(connection_pool=self.pool)
 
     def get(self, key):
         return self.redis_base.get(key)
@@ -33,25 +130,782 @@ class RedisStore(object):
     def set(self, key, value, expire=None):
         return self.redis_base.set(key, value, ex=expire)
 
+    def get_many(self, keys):
+        return self.redis_base.mget(keys) if keys else []
+
+    def set_many(self, items, expire=None):
+        pipeline = self.redis_base.pipeline(transaction=False)
+        for key, value in items:
+            pipeline.set(key, value, ex=expire)
+        return all(pipeline.execute())
+
+
+class MemoryStore(object):
+    """In-process backend of `Store`, for benchmarks and deployments without Redis.
+
+    Values are kept as strings, like Redis returns them. Keys with an
+    expiry are also pushed on a heap by expiration time: every write
+    drops the expired keys from its top, and reads never return an
+    expired key. The heap is rebuilt when overwritten keys leave it
+    twice as long as the store. Safe to share between threads; every
+    process has its own data.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.expiry = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None or item[1] is not None and item[1] <= time.time():
+            return None
+        return item[0]
+
+    def set(self, key, value, expire=None):
+        self.set_many([(key, value)], expire)
+        return True
+
+    def get_many(self, keys):
+        now = time.time()
+        values = []
+        for key in keys:
+            item = self.items.get(key)
+            expired = item is None or item[1] is not None and item[1] <= now
+            values.append(None if expired else item[0])
+        return values
+
+    def set_many(self, items, expire=None):
+        now = time.time()
+        expires_at = now + expire if expire else None
+        with self.lock:
+            for key, value in items:
+                if isinstance(value, float):
+                    value = repr(value)
+                elif not isinstance(value, basestring):
+                    value = str(value)
+                self.items[key] = (value, expires_at)
+                if expires_at is not None:
+                    heapq.heappush(self.expiry, (expires_at, key))
+            self.purge(now)
+        return True
+
+    def purge(self, now):
+        expiry, items = self.expiry, self.items
+        while expiry and expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(expiry)
+            item = items.get(key)
+            if item is not None and item[1] == expires_at:
+                del items[key]
+        if len(expiry) > 2 * len(items) + 1024:
+            self.expiry = [(item[1], key) for key, item in items.iteritems() if item[1] is not None]
+            heapq.heapify(self.expiry)
+
+
+class HashRing(object):
+    """Consistent hashing of keys to nodes.
+
+    Every node owns `replicas` points of the ring and a key belongs to
+    the node of the first point after the key's hash, so adding a node
+    moves only the keys of the arcs it takes over, about 1/N of them.
+    """
+
+    def __init__(self, nodes=(), replicas=160):
+        self.replicas = replicas
+        self.ring = ([], [])
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def hash(key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return struct.unpack('>Q', hashlib.md5(key).digest()[:8])[0]
+
+    def rebuild(self, points):
+        hashes = sorted(points)
+        self.ring = (hashes, [points[point] for point in hashes])
+
+    def add(self, node):
+        points = dict(zip(*self.ring))
+        for replica in range(self.replicas):
+            points[self.hash("%s#%d" % (node, replica))] = node
+        self.rebuild(points)
+
+    def remove(self, node):
+        self.rebuild(dict(point for point in zip(*self.ring) if point[1] != node))
+
+    def node(self, key):
+        hashes, nodes = self.ring
+        if not hashes:
+            raise KeyError('Hash ring has no nodes')
+        return nodes[bisect.bisect(hashes, self.hash(key)) % len(hashes)]
+
+
+class ShardedStore(object):
+    """Backend of `Store` spreading keys over several backends.
+
+    `nodes` are pairs of a name and a backend, like `RedisStore`. The
+    name places the node on the `HashRing`, so it must not change
+    between restarts. Bulk calls are split by node; the parts go to
+    their nodes at the same time from up to `threads` threads.
+
+    Keys are written to their node only. A key missing on its node is
+    read from the node that owned it in the `previous` nodes, pairs
+    like `nodes`, or before the last `add_node`; so keys are found
+    after the nodes change until they are written again.
+    """
+
+    def __init__(self, nodes, replicas=160, threads=None, previous=None):
+        self.nodes = collections.OrderedDict(nodes)
+        self.ring = HashRing(self.nodes, replicas)
+        self.previous_nodes = collections.OrderedDict(previous or ())
+        self.previous_ring = HashRing(self.previous_nodes, replicas) if previous else None
+        self.threads = threads
+        self.pool = None
+        self.pid = None
+        self.pool_lock = threading.Lock()
+
+    def add_node(self, name, store):
+        self.previous_nodes = collections.OrderedDict(self.nodes)
+        self.previous_ring = HashRing(self.previous_nodes, self.ring.replicas)
+        self.nodes[name] = store
+        self.ring.add(name)
+
+    def node(self, key):
+        return self.nodes[self.ring.node(key)]
+
+    def previous_node(self, key):
+        """Name of the node that owned `key` before, `None` if it did not move."""
+        if self.previous_ring is None:
+            return None
+        name = self.previous_ring.node(key)
+        return None if name == self.ring.node(key) else name
+
+    def get(self, key):
+        value = self.node(key).get(key)
+        if value is None:
+            name = self.previous_node(key)
+            if name is not None:
+                value = self.previous_nodes[name].get(key)
+        return value
+
+    def set(self, key, value, expire=None):
+        return self.node(key).set(key, value, expire)
+
+    def split(self, keys, ring=None):
+        """Indexes of `keys` by node name."""
+        parts = collections.OrderedDict()
+        for index, key in enumerate(keys):
+            parts.setdefault((ring or self.ring).node(key), []).append(index)
+        return parts
+
+    def start_pool(self):
+        """Thread pool of this process, started by the first caller."""
+        with self.pool_lock:
+            if self.pid != os.getpid():
+                self.pool = ThreadPool(self.threads or len(self.nodes))
+                self.pid = os.getpid()
+        return self.pool
+
+    def fan_out(self, calls):
+        """Results of `(function, args)` calls; all but the first run in the pool."""
+        if len(calls) > 1 and self.pid != os.getpid():
+            self.start_pool()
+        pending = [self.pool.apply_async(function, args) for function, args in calls[1:]]
+        results = [calls[0][0](*calls[0][1])] if calls else []
+        return results + [result.get() for result in pending]
+
+    def read_parts(self, nodes, keys, parts, values):
+        """Reads the `parts` of `keys` from `nodes` into `values`."""
+        results = self.fan_out([(nodes[name].get_many, ([keys[index] for index in indexes],))
+                                for name, indexes in parts.items()])
+        for indexes, part in zip(parts.values(), results):
+            for index, value in zip(indexes, part):
+                values[index] = value
+
+    def get_many(self, keys):
+        values = [None] * len(keys)
+        self.read_parts(self.nodes, keys, self.split(keys), values)
+        moved = [index for index, value in enumerate(values)
+                 if value is None and self.previous_node(keys[index]) is not None]
+        if moved:
+            parts = self.split([keys[index] for index in moved], self.previous_ring)
+            moved_values = [None] * len(moved)
+            self.read_parts(self.previous_nodes, [keys[index] for index in moved], parts, moved_values)
+            for index, value in zip(moved, moved_values):
+                values[index] = value
+        return values
+
+    def set_many(self, items, expire=None):
+        items = list(items)
+        parts = self.split([key for key, _ in items])
+        return all(self.fan_out([(self.nodes[name].set_many, ([items[index] for index in indexes], expire))
+                                 for name, indexes in parts.items()]))
+
+
+class Deadline(object):
+    """Point in time by which a request has to be answered."""
+
+    def __init__(self, timeout):
+        self.expires_at = time.time() + timeout
+
+    def remaining(self):
+        return max(self.expires_at - time.time(), 0)
+
+    @property
+    def expired(self):
+        return time.time() >= self.expires_at
+
+    def __repr__(self):
+        return '<Deadline %.3fs left>' % self.remaining()
+
 
 class Store(object):
+    """Store that survives an unavailable backend.
+
+    `get` retries by `retry_policy` and returns `None` when the backend
+    stays unavailable. Cache calls retry by the shorter
+    `cache_retry_policy` and are skipped at once while `breaker` is open,
+    so a caller falls back to computing the value instead of waiting.
+
+    Every call takes an optional `Deadline`: no attempt is started and
+    no retry is waited for past it.
+    """
+
     MAX_ATTEMPT = 3
     TIMEOUT = 0.2
 
-    def __init__(self, store):
+    def __init__(self, store, retry_policy=None, cache_retry_policy=None, breaker=None):
         self.store = store
+        self.retry_policy = retry_policy or RetryPolicy(self.MAX_ATTEMPT, cap=self.TIMEOUT)
+        self.cache_retry_policy = cache_retry_policy or RetryPolicy(
+            self.MAX_ATTEMPT, base=0.01, cap=0.05, budget=0.05)
+        self.breaker = breaker or CircuitBreaker()
 
-    def get(self, key):
-        for _ in range(self.MAX_ATTEMPT):
+    def attempt(self, op, policy, deadline, method, *args, **kwargs):
+        if deadline is not None and deadline.expired:
+            raise TimeoutError('Request deadline exceeded')
+        delays = policy.delays()
+        while True:
             try:
-                return self.store.get(key)
-            except (TimeoutError, ConnectionError):
-                time.sleep(self.TIMEOUT)
+                return method(*args, **kwargs)
+            except STORE_ERRORS:
+                delay = next(delays, None)
+                if delay is None or deadline is not None and delay >= deadline.remaining():
+                    raise
+                STORE_RETRIES.inc((op,))
+                time.sleep(delay)
+
+    def count(self, op, result):
+        """Counts hits and misses of reads, keys of bulk reads one by one."""
+        if op.endswith("get_many"):
+            hits = sum(1 for value in result if value is not None)
+            STORE_RESULTS.inc((op, "hit"), hits)
+            STORE_RESULTS.inc((op, "miss"), len(result) - hits)
+        elif op.endswith("get"):
+            STORE_RESULTS.inc((op, "miss" if result is None else "hit"))
+        else:
+            STORE_RESULTS.inc((op, "ok"))
+
+    def cache_attempt(self, op, deadline, method, *args, **kwargs):
+        if deadline is not None and deadline.expired or not self.breaker.allow():
+            STORE_RESULTS.inc((op, "skipped"))
+            return None
+        try:
+            result = self.attempt(op, self.cache_retry_policy, deadline, method, *args, **kwargs)
+        except STORE_ERRORS:
+            self.breaker.failure()
+            STORE_RESULTS.inc((op, "error"))
+            return None
+        self.breaker.success()
+        self.count(op, result)
+        return result
+
+    def get(self, key, deadline=None):
+        try:
+            value = self.attempt("get", self.retry_policy, deadline, self.store.get, key)
+        except STORE_ERRORS:
+            STORE_RESULTS.inc(("get", "error"))
+            return None
+        self.count("get", value)
+        return value
+
+    def get_many(self, keys, deadline=None):
+        """Gets values of all `keys` in one round trip.
+
+        A key that could not be read is returned as `None`, like `get`.
+        """
+        try:
+            values = self.attempt("get_many", self.retry_policy, deadline, self.store.get_many, keys)
+        except STORE_ERRORS:
+            STORE_RESULTS.inc(("get_many", "error"))
+            return [None] * len(keys)
+        self.count("get_many", values)
+        return values
+
+    def cache_get(self, key, deadline=None):
+        return self.cache_attempt("cache_get", deadline, self.store.get, key)
+
+    def cache_set(self, key, value, expire=None, deadline=None):
+        return self.cache_attempt("cache_set", deadline, self.store.set, key, value, expire=expire)
+
+    def cache_get_many(self, keys, deadline=None):
+        return self.cache_attempt("cache_get_many", deadline, self.store.get_many, keys)
+
+    def cache_set_many(self, items, expire=None, deadline=None):
+        return self.cache_attempt("cache_set_many", deadline, self.store.set_many, items, expire=expire)
+
+
+#***********************************************LOCAL CACHE*************************************************************
+
+class LocalCache(object):
+    """Bounded in-process LRU cache with expiration of every key.
+
+    Counts hits, misses (including expired keys) and evictions of the
+    least recently used keys, also in `LOCAL_CACHE` under `name`. Safe
+    to share between threads.
+    """
+
+    def __init__(self, max_size=10000, ttl=60, name="score"):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is None or item[1] <= time.time():
+                self.misses += 1
+                LOCAL_CACHE.inc((self.name, "miss"))
+                return None
+            self.items[key] = item
+            self.hits += 1
+            LOCAL_CACHE.inc((self.name, "hit"))
+            return item[0]
+
+    def set(self, key, value, expire=None):
+        """Caches `value` for `expire` seconds, but no longer than `ttl`."""
+        ttl = min(expire or self.ttl, self.ttl)
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = (value, time.time() + ttl)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+                LOCAL_CACHE.inc((self.name, "eviction"))
+
+    def stats(self):
+        return {"size": len(self.items), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+class CachedStore(object):
+    """`Store` answering `cache_get` from a `LocalCache` when it can.
+
+    Values written with `cache_set` are cached locally and in the store.
+    Other calls go straight to the wrapped store.
+    """
+
+    def __init__(self, store, cache):
+        self.store = store
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def cache_get(self, key, deadline=None):
+        value = self.cache.get(key)
+        if value is None:
+            value = self.store.cache_get(key, deadline=deadline)
+            if value is not None:
+                self.cache.set(key, value)
+        return value
+
+    def cache_set(self, key, value, expire=None, deadline=None):
+        self.cache.set(key, value, expire)
+        return self.store.cache_set(key, value, expire, deadline=deadline)
+
+    def cache_get_many(self, keys, deadline=None):
+        values = [self.cache.get(key) for key in keys]
+        missed = [key for key, value in zip(keys, values) if value is None]
+        if not missed:
+            return values
+        fetched = dict(zip(missed, self.store.cache_get_many(missed, deadline=deadline) or []))
+        for key, value in fetched.items():
+            if value is not None:
+                self.cache.set(key, value)
+        return [fetched.get(key) if value is None else value for key, value in zip(keys, values)]
+
+    def cache_set_many(self, items, expire=None, deadline=None):
+        for key, value in items:
+            self.cache.set(key, value, expire)
+        return self.store.cache_set_many(items, expire, deadline=deadline)
+
+
+class WriteBehindStore(object):
+    """`Store` whose cache writes return at once and reach the store later.
+
+    Writes wait in a buffer where a key written again keeps only its
+    latest value. A background thread writes the buffer with pipelined
+    `cache_set_many` calls of up to `batch_size` keys as soon as that
+    many wait, and at least every `interval` seconds. While
+    `max_pending` keys wait, writes of new keys are dropped: the values
+    are only a cache. Reads see the values still waiting. Other calls go
+    straight to the wrapped store. Share one per process.
+    """
+
+    def __init__(self, store, batch_size=100, interval=0.05, max_pending=10000):
+        self.store = store
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.pending = collections.OrderedDict()
+        self.cond = threading.Condition()
+        self.start_lock = threading.Lock()
+        self.pid = None
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def start(self):
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            thread = threading.Thread(target=self.write_pending)
+            thread.daemon = True
+            thread.start()
+
+    def cache_get(self, key, deadline=None):
+        item = self.pending.get(key)
+        if item is not None:
+            return item[0]
+        return self.store.cache_get(key, deadline=deadline)
+
+    def cache_get_many(self, keys, deadline=None):
+        items = [self.pending.get(key) for key in keys]
+        missed = [key for key, item in zip(keys, items) if item is None]
+        fetched = dict(zip(missed, self.store.cache_get_many(missed, deadline=deadline) or [])) if missed else {}
+        return [fetched.get(key) if item is None else item[0] for key, item in zip(keys, items)]
+
+    def cache_set(self, key, value, expire=None, deadline=None):
+        return self.cache_set_many([(key, value)], expire)
+
+    def cache_set_many(self, items, expire=None, deadline=None):
+        if self.pid != os.getpid():
+            self.start()
+        with self.cond:
+            waiting = len(self.pending)
+            for key, value in items:
+                if key in self.pending:
+                    WRITE_BEHIND.inc(("coalesced",))
+                elif len(self.pending) >= self.max_pending:
+                    WRITE_BEHIND.inc(("dropped",))
+                    continue
+                else:
+                    WRITE_BEHIND.inc(("queued",))
+                self.pending[key] = (value, expire)
+            if not waiting or len(self.pending) >= self.batch_size:
+                self.cond.notify()
+        return True
+
+    def take(self):
+        with self.cond:
+            batch = []
+            while self.pending and len(batch) < self.batch_size:
+                key, (value, expire) = self.pending.popitem(last=False)
+                batch.append((key, value, expire))
+            return batch
+
+    def write(self, batch):
+        by_expire = collections.OrderedDict()
+        for key, value, expire in batch:
+            by_expire.setdefault(expire, []).append((key, value))
+        for expire, items in by_expire.items():
+            written = self.store.cache_set_many(items, expire)
+            WRITE_BEHIND.inc(("written" if written else "failed",), len(items))
+
+    def flush(self):
+        """Writes everything waiting, in the calling thread."""
+        batch = self.take()
+        while batch:
+            self.write(batch)
+            batch = self.take()
+
+    def write_pending(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                if len(self.pending) < self.batch_size:
+                    self.cond.wait(self.interval)
+            batch = self.take()
+            if batch:
+                try:
+                    self.write(batch)
+                except Exception:
+                    WRITE_BEHIND.inc(("failed",), len(batch))
+
+
+#***********************************************ASYNC*******************************************************************
+
+INCOMPLETE = object()
+
+
+def encode_command(args):
+    parts = ['*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, unicode):
+            arg = arg.encode('utf-8')
+        elif isinstance(arg, float):
+            arg = repr(arg)
+        elif not isinstance(arg, str):
+            arg = str(arg)
+        parts.append('$%d\r\n%s\r\n' % (len(arg), arg))
+    return ''.join(parts)
+
+
+def parse_reply(buf, pos=0):
+    """Parses one RESP reply from `buf` starting at `pos`.
+
+    Returns the reply and the position after it, or `INCOMPLETE` and
+    `pos` when the buffer does not hold the whole reply yet.
+    """
+    end = buf.find('\r\n', pos)
+    if end < 0:
+        return INCOMPLETE, pos
+    kind, line, start = buf[pos], buf[pos + 1:end], end + 2
+    if kind == '+':
+        return line, start
+    if kind == '-':
+        return ResponseError(line), start
+    if kind == ':':
+        return int(line), start
+    if kind == '$':
+        length = int(line)
+        if length < 0:
+            return None, start
+        if len(buf) < start + length + 2:
+            return INCOMPLETE, pos
+        return buf[start:start + length].decode('utf-8'), start + length + 2
+    if kind == '*':
+        count = int(line)
+        if count < 0:
+            return None, start
+        items = []
+        for _ in range(count):
+            item, start = parse_reply(buf, start)
+            if item is INCOMPLETE:
+                return INCOMPLETE, pos
+            items.append(item)
+        return items, start
+    raise ResponseError('Protocol error: %r' % kind)
+
+
+class AsyncRedisStore(asyncore.dispatcher):
+    """Non-blocking Redis client running on an `EventLoop`.
+
+    Commands are pipelined over a single connection and answered with
+    futures in the order they were sent. A broken connection fails all
+    pending futures and is reopened by the next command.
+    """
+
+    def __init__(self, loop, host='localhost', db=None, port=6379, timeout=None,
+                 keepalive=False, unix_socket=None):
+        asyncore.dispatcher.__init__(self, map=loop.map)
+        self.loop = loop
+        self.address = unix_socket or (host, port)
+        self.db = db or 0
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.opened = False
+        self.timer = None
+        self.reset()
+
+    def reset(self):
+        self.outbuf = ''
+        self.inbuf = ''
+        self.waiting = collections.deque()
+
+    def open(self):
+        if isinstance(self.address, tuple):
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            if self.keepalive:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        else:
+            self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.opened = True
+        self.connect(self.address)
+        if self.db:
+            self.outbuf += encode_command(('SELECT', self.db))
+            self.waiting.append(Future())
+
+    def execute(self, *args):
+        future = Future()
+        if not self.opened:
+            self.open()
+        self.outbuf += encode_command(args)
+        self.waiting.append(future)
+        if self.timer is None and self.timeout:
+            self.timer = self.loop.call_later(self.timeout, self.handle_timeout)
+        return future
+
+    def get(self, key):
+        return self.execute('GET', key)
+
+    def set(self, key, value, expire=None):
+        args = ('SET', key, value) + (('EX', expire) if expire else ())
+        result = Future()
+
+        def done(future):
+            if future.exc_info():
+                result.set_exc_info(future.exc_info())
+            else:
+                result.set_result(future.result() == 'OK')
+
+        self.execute(*args).add_done_callback(done)
+        return result
+
+    def get_many(self, keys):
+        return self.execute('MGET', *keys)
+
+    def writable(self):
+        return bool(self.outbuf) or not self.connected
+
+    def readable(self):
+        return True
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+        sent = self.send(self.outbuf)
+        self.outbuf = self.outbuf[sent:]
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if not data:
+            return
+        self.inbuf += data
+        pos = 0
+        while self.waiting:
+            reply, pos = parse_reply(self.inbuf, pos)
+            if reply is INCOMPLETE:
+                break
+            future = self.waiting.popleft()
+            if isinstance(reply, ResponseError):
+                future.set_exception(reply)
+            else:
+                future.set_result(reply)
+        self.inbuf = self.inbuf[pos:]
+        self.rearm_timer()
+
+    def rearm_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.waiting and self.timeout:
+            self.timer = self.loop.call_later(self.timeout, self.handle_timeout)
+
+    def handle_timeout(self):
+        self.timer = None
+        self.fail(TimeoutError('Timeout reading from %s' % (self.address,)))
+
+    def handle_close(self):
+        self.fail(ConnectionError('Connection to %s closed' % (self.address,)))
+
+    def handle_error(self):
+        self.fail(ConnectionError('Error on connection to %s' % (self.address,)))
+
+    def fail(self, exception):
+        waiting = self.waiting
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.close()
+        self.opened = False
+        self.reset()
+        for future in waiting:
+            future.set_exception(exception)
+
+
+class AsyncStore(object):
+    """Asynchronous counterpart of `Store`.
+
+    Every method returns a future. Failed attempts are retried on the
+    loop's timer, so a Redis hiccup never blocks the loop.
+    """
+
+    MAX_ATTEMPT = Store.MAX_ATTEMPT
+    TIMEOUT = Store.TIMEOUT
+
+    def __init__(self, store, loop=None, retry_policy=None, cache_retry_policy=None, breaker=None):
+        self.store = store
+        self.loop = loop or store.loop
+        self.retry_policy = retry_policy or RetryPolicy(self.MAX_ATTEMPT, cap=self.TIMEOUT)
+        self.cache_retry_policy = cache_retry_policy or RetryPolicy(
+            self.MAX_ATTEMPT, base=0.01, cap=0.05, budget=0.05)
+        self.breaker = breaker or CircuitBreaker()
+
+    def attempt(self, policy, deadline, default, breaker, method, *args):
+        """Future of `method` result, retried by `policy`.
+
+        Resolves to `default` when the store stays unavailable or the
+        deadline passes, even if the store has not replied yet.
+        """
+        result = Future()
+        delays = policy.delays()
+
+        def run():
+            method(*args).add_done_callback(done)
+
+        def done(future):
+            if result.done():
+                return
+            error = future.exception()
+            if error is None:
+                if breaker:
+                    breaker.success()
+                result.set_result(future.result())
+            elif not isinstance(error, STORE_ERRORS):
+                result.set_exc_info(future.exc_info())
+            else:
+                delay = next(delays, None)
+                if delay is not None and (deadline is None or delay < deadline.remaining()):
+                    self.loop.call_later(delay, run)
+                    return
+                if breaker:
+                    breaker.failure()
+                result.set_result(default)
+
+        if deadline is not None and deadline.expired or breaker and not breaker.allow():
+            result.set_result(default)
+            return result
+        if deadline is not None:
+            timer = self.loop.call_later(deadline.remaining(), result.set_result, default)
+            result.add_done_callback(lambda _: timer.cancel())
+        run()
+        return result
+
+    def get(self, key, deadline=None):
+        return self.attempt(self.retry_policy, deadline, None, None, self.store.get, key)
+
+    def get_many(self, keys, deadline=None):
+        if not keys:
+            return resolved([])
+        return self.attempt(self.retry_policy, deadline, [None] * len(keys), None, self.store.get_many, keys)
 
-    @connection_attempt((TimeoutError, ConnectionError), MAX_ATTEMPT, TIMEOUT)
-    def cache_get(self, key):
-        return self.store.get(key)
+    def cache_get(self, key, deadline=None):
+        return self.attempt(self.cache_retry_policy, deadline, None, self.breaker, self.store.get, key)
 
-    @connection_attempt((TimeoutError, ConnectionError), MAX_ATTEMPT, TIMEOUT)
-    def cache_set(self, key, value, expire=None):
-        return self.store.set(key, value, expire=expire)
+    def cache_set(self, key, value, expire=None, deadline=None):
+        return self.attempt(self.cache_retry_policy, deadline, None, self.breaker, self.store.set, key, value, expire)
@@ -10,6 +10,7 @@ import os
 
 sys.path.append(os.path.join(os.getcwd(), ''))
 import api
+from mock import MagicMock
 from store import Store, RedisStore
 from tests.cases import cases
 
@@ -46,14 +47,30 @@ class TestSuite(unittest.TestCase):
         _, code = self.get_response({})
         self.assertEqual(api.INVALID_REQUEST, code)
 
+    @cases([[], 0, "", [{}], "request"])
+    def test_request_not_an_object(self, request):
+        self.assertEqual(("<Invalid request: expected an object>", api.INVALID_REQUEST), self.get_response(request))
+
     @cases([
         {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "", "arguments": {}},
         {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "sdd", "arguments": {}},
         {"account": "horns&hoofs", "login": "admin", "method": "online_score", "token": "", "arguments": {}},
     ])
     def test_bad_auth(self, request):
+        failures = api.AUTH_FAILURES.value()
         _, code = self.get_response(request)
         self.assertEqual(api.FORBIDDEN, code)
+        self.assertEqual(failures + 1, api.AUTH_FAILURES.value())
+
+    def test_validation_error_metrics(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "arguments": {"phone": "89175002040", "email": "stupnikov.otus.ru"}}
+        self.set_valid_auth(request)
+        before = [api.VALIDATION_ERRORS.value((field,)) for field in ("phone", "email", "gender")]
+        _, code = self.get_response(request)
+        self.assertEqual(api.INVALID_REQUEST, code)
+        after = [api.VALIDATION_ERRORS.value((field,)) for field in ("phone", "email", "gender")]
+        self.assertEqual([1, 1, 0], [a - b for a, b in zip(after, before)])
 
     @cases([
         {"account": "horns&hoofs", "login": "h&f", "method": "online_score"},
@@ -146,6 +163,76 @@ class TestSuite(unittest.TestCase):
                         for v in response.values()))
         self.assertEqual(self.context.get("nclients"), len(arguments["client_ids"]))
 
+    def test_deadline_exceeded(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2]}}
+        self.set_valid_auth(request)
+        self.context["deadline"] = api.Deadline(0)
+        _, code = self.get_response(request)
+        self.assertEqual(api.GATEWAY_TIMEOUT, code)
+
+    @cases([
+        ({}, None, None),
+        ({}, 2, 2),
+        ({"X-Request-Timeout": "0.5"}, None, 0.5),
+        ({"X-Request-Timeout": "0.5"}, 2, 0.5),
+        ({"X-Request-Timeout": "5"}, 2, 2),
+        ({"X-Request-Timeout": "soon"}, 2, 2),
+        ({"X-Request-Timeout": "-1"}, None, None),
+    ])
+    def test_get_deadline(self, headers, timeout, expected):
+        deadline = api.get_deadline(headers, timeout)
+        if expected is None:
+            self.assertIsNone(deadline)
+        else:
+            self.assertAlmostEqual(expected, deadline.remaining(), places=1)
+
+    def test_batch_request(self):
+        requests = [
+            {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+             "arguments": {"phone": "79175002040", "email": "fake_email@mail.ru"}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+             "arguments": {"client_ids": [1, 2]}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+             "arguments": {"phone": "79175002040"}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+             "arguments": {"first_name": "a", "last_name": "b"}},
+            {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+             "arguments": {"client_ids": [2, 3]}},
+            {"account": "horns&hoofs", "login": "admin", "method": "online_score", "arguments": {}},
+        ]
+        for request in requests:
+            self.set_valid_auth(request)
+        requests[5]["token"] = "bad"
+        requests.append("not an object")
+
+        self.store.cache_get_many = MagicMock(wraps=self.store.cache_get_many)
+        self.store.get_many = MagicMock(wraps=self.store.get_many)
+        response, code = api.batch_handler({"body": requests, "headers": self.headers}, self.context, self.store)
+        self.assertEqual(api.OK, code)
+        self.assertEqual([api.OK, api.OK, api.INVALID_REQUEST, api.OK, api.OK, api.FORBIDDEN, api.INVALID_REQUEST],
+                         [item["code"] for item in response])
+        self.assertEqual({"score": 3.0}, response[0]["response"])
+        self.assertEqual({"score": 0.5}, response[3]["response"])
+        self.assertEqual(["1", "2"], sorted(response[1]["response"]))
+        self.assertEqual(response[1]["response"]["2"], response[4]["response"]["2"])
+        self.assertEqual(1, self.store.cache_get_many.call_count)
+        self.assertEqual(1, self.store.get_many.call_count)
+        self.assertEqual(len(requests), len(self.context["items"]))
+
+    def test_batch_request_not_a_list(self):
+        _, code = api.batch_handler({"body": {"method": "online_score"}, "headers": self.headers},
+                                    self.context, self.store)
+        self.assertEqual(api.INVALID_REQUEST, code)
+
+    @cases([([], api.OK), ([{}] * (api.MAX_BATCH_SIZE + 1), api.INVALID_REQUEST)])
+    def test_batch_size(self, requests, code):
+        response, answer_code = api.batch_handler({"body": requests, "headers": self.headers},
+                                                  self.context, self.store)
+        self.assertEqual(code, answer_code)
+        if code == api.OK:
+            self.assertEqual([], response)
+
 
 if __name__ == "__main__":
     unittest.main()
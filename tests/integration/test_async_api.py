@@ -0,0 +1,96 @@
+import hashlib
+import httplib
+import json
+import socket
+import threading
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.join(os.getcwd(), ''))
+import api
+import async_api
+from eventloop import EventLoop
+from store import AsyncStore, AsyncRedisStore, RedisStore
+
+
+class TestAsyncServer(unittest.TestCase):
+    def setUp(self):
+        self.loop = EventLoop(poll_interval=0.05)
+        store = AsyncStore(AsyncRedisStore(self.loop), self.loop)
+        self.server = async_api.AsyncHTTPServer(("localhost", 0), self.loop, store)
+        self.port = self.server.socket.getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        redis_store = RedisStore()
+        for i, interest in enumerate(['books', 'cinema'], start=1000):
+            redis_store.set('i:%s' % i, '["%s"]' % interest, 60)
+        redis_store.redis_base.delete('i:1002')
+
+    def tearDown(self):
+        self.loop.call_soon(self.loop.stop)
+        self.thread.join(5)
+        self.server.close()
+
+    def get_request(self, method, arguments):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": method, "arguments": arguments}
+        request["token"] = hashlib.sha512(request["account"] + request["login"] + api.SALT).hexdigest()
+        return json.dumps(request)
+
+    def test_keep_alive_requests(self):
+        conn = httplib.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request("POST", "/method/", self.get_request("online_score", {"first_name": "a", "last_name": "b"}))
+        response = conn.getresponse()
+        self.assertEqual(api.OK, response.status)
+        self.assertEqual({"code": api.OK, "response": {"score": 0.5}}, json.loads(response.read()))
+
+        conn.request("POST", "/method/", self.get_request("clients_interests", {"client_ids": [1000, 1001, 1002]}))
+        response = json.loads(conn.getresponse().read())
+        self.assertEqual({"1000": ["books"], "1001": ["cinema"], "1002": []}, response["response"])
+        conn.close()
+
+    def test_pipelined_requests(self):
+        body = self.get_request("online_score", {"phone": "79175002040", "email": "a@b.ru"})
+        request = "POST /method/ HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+        sock = socket.create_connection(("localhost", self.port), timeout=5)
+        sock.sendall(request + request + "POST /nowhere/ HTTP/1.1\r\nContent-Length: 8\r\n\r\n{\"a\": 1}")
+        data = ''
+        while data.count('HTTP/1.1 ') < 3:
+            data += sock.recv(65536)
+        sock.close()
+        self.assertEqual(2, data.count('"score": 3.0'))
+        self.assertTrue(data.rindex('HTTP/1.1 200') < data.index('HTTP/1.1 404'))
+
+    def test_bad_request(self):
+        conn = httplib.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request("POST", "/method/", "{not json")
+        response = conn.getresponse()
+        self.assertEqual(api.BAD_REQUEST, response.status)
+        self.assertEqual(api.BAD_REQUEST, json.loads(response.read())["code"])
+
+    def test_negative_content_length(self):
+        sock = socket.create_connection(("localhost", self.port), timeout=5)
+        sock.sendall("POST /method/ HTTP/1.1\r\nContent-Length: -5\r\n\r\n{}")
+        data = ''
+        while 'Connection: close' not in data:
+            data += sock.recv(65536)
+        sock.close()
+        self.assertTrue(data.startswith('HTTP/1.1 400'))
+
+    def test_long_pipeline(self):
+        request = "POST /method/ HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}"
+        sock = socket.create_connection(("localhost", self.port), timeout=5)
+        sock.sendall(request * 400)
+        data = ''
+        while data.count('HTTP/1.1 ') < 400:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        sock.close()
+        self.assertEqual(400, data.count('HTTP/1.1 200'))
+
+
+if __name__ == "__main__":
+    unittest.main()
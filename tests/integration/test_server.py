@@ -0,0 +1,315 @@
+import errno
+import hashlib
+import httplib
+import json
+import re
+import signal
+import socket
+import threading
+import time
+import unittest
+import sys
+import os
+from mock import MagicMock, patch
+
+sys.path.append(os.path.join(os.getcwd(), ''))
+import api
+from store import Store, RedisStore
+from tests.cases import cases
+
+
+class TestThreadPoolServer(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.stores = []
+
+        def slow_handler(request, ctx, store):
+            self.release.wait(5)
+            return {}, api.OK
+
+        class Handler(api.MainHTTPHandler):
+            router = dict(api.MainHTTPHandler.router, slow=slow_handler)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = api.ThreadPoolHTTPServer(("localhost", 0), Handler, self.store_factory, threads=2)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def store_factory(self):
+        store = Store(RedisStore())
+        self.stores.append((threading.current_thread().ident, store))
+        return store
+
+    def post(self, path, body):
+        conn = httplib.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request("POST", path, json.dumps(body))
+        response = json.loads(conn.getresponse().read())
+        conn.close()
+        return response
+
+    def get_request(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "arguments": {"first_name": "a", "last_name": "b"}}
+        request["token"] = hashlib.sha512(request["account"] + request["login"] + api.SALT).hexdigest()
+        return request
+
+    def test_blocked_request_does_not_stall_others(self):
+        slow = threading.Thread(target=self.post, args=("/slow/", {"slow": True}))
+        slow.start()
+        response = self.post("/method/", self.get_request())
+        self.assertFalse(self.release.is_set())
+        self.assertEqual(api.OK, response["code"])
+        self.release.set()
+        slow.join(5)
+
+    def test_store_per_worker_thread(self):
+        for _ in range(4):
+            self.assertEqual(api.OK, self.post("/method/", self.get_request())["code"])
+        threads = [ident for ident, _ in self.stores]
+        self.assertEqual(len(threads), len(set(threads)))
+        self.assertTrue(1 <= len(self.stores) <= 2)
+
+    def test_metrics(self):
+        self.assertEqual(api.OK, self.post("/method/", self.get_request())["code"])
+        self.assertEqual(api.NOT_FOUND, self.post("/nowhere/", {"a": 1})["code"])
+        conn = httplib.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request("GET", "/metrics")
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        self.assertEqual(api.OK, response.status)
+        self.assertTrue(response.getheader("Content-Type").startswith("text/plain"))
+        self.assertIn('scoring_requests_total{method="online_score",code="200"}', body)
+        self.assertIn('scoring_requests_total{method="unknown",code="404"}', body)
+        self.assertIn('scoring_request_duration_seconds_count{method="online_score"}', body)
+        self.assertIn('scoring_requests_in_flight 0', body)
+        self.assertIn('scoring_store_results_total{op="cache_get"', body)
+
+    def test_empty_batch(self):
+        self.assertEqual({"code": api.OK, "response": []}, self.post("/batch/", []))
+
+    @cases([[], 0, ""])
+    def test_method_body_not_an_object(self, body):
+        self.assertEqual(api.INVALID_REQUEST, self.post("/method/", body)["code"])
+
+    def test_get_unknown_path(self):
+        conn = httplib.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request("GET", "/method/")
+        response = conn.getresponse()
+        self.assertEqual(api.NOT_FOUND, json.loads(response.read())["code"])
+        conn.close()
+
+    def test_access_log_goes_through_logging(self):
+        handler = MagicMock(client_address=("127.0.0.1", 5000))
+        with patch("api.logging") as logging:
+            api.MainHTTPHandler.log_message.__func__(handler, '"%s" %s %s', "POST /method/ HTTP/1.1", 200, "-")
+        logging.info.assert_called_once_with("%s - - %s", "127.0.0.1", '"POST /method/ HTTP/1.1" 200 -')
+
+
+class TestKeepAlive(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.slow = []
+
+        def slow_handler(request, ctx, store):
+            self.slow.append(request)
+            self.release.wait(5)
+            return {}, api.OK
+
+        class Handler(api.MainHTTPHandler):
+            router = dict(api.MainHTTPHandler.router, slow=slow_handler)
+            max_requests = 3
+            idle_timeout = 0.5
+
+            def log_message(self, *args):
+                pass
+
+        self.server = api.ThreadPoolHTTPServer(("localhost", 0), Handler, lambda: Store(RedisStore()), threads=2)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def raw_request(self, body, headers=""):
+        return ("POST /method/ HTTP/1.1\r\nHost: localhost\r\n%sContent-Length: %d\r\n\r\n%s"
+                % (headers, len(body), body))
+
+    def read_all(self, sock):
+        data = ''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return data
+            data += chunk
+
+    def test_requests_share_connection(self):
+        conn = httplib.HTTPConnection("localhost", self.port, timeout=5)
+        socks = []
+        for _ in range(2):
+            conn.request("POST", "/method/", json.dumps({"login": "h&f"}))
+            response = conn.getresponse()
+            self.assertEqual(api.INVALID_REQUEST, json.loads(response.read())["code"])
+            self.assertIsNone(response.getheader("Connection"))
+            socks.append(conn.sock)
+        self.assertIs(socks[0], socks[1])
+        conn.close()
+
+    def test_pipelined_requests_until_max_requests(self):
+        sock = socket.create_connection(("localhost", self.port), timeout=5)
+        sock.sendall(self.raw_request('{"a": 1}') + self.raw_request('x') + self.raw_request('{"a": 1}') +
+                     self.raw_request('{"a": 1}'))
+        data = self.read_all(sock)
+        sock.close()
+        self.assertEqual(["422", "400", "422"], re.findall(r"HTTP/1.1 (\d+)", data))
+        self.assertEqual(1, data.count("Connection: close"))
+
+    def test_client_closes_connection(self):
+        sock = socket.create_connection(("localhost", self.port), timeout=5)
+        sock.sendall(self.raw_request('{"a": 1}', "Connection: close\r\n"))
+        data = self.read_all(sock)
+        sock.close()
+        self.assertIn("Connection: close", data)
+
+    def test_http10_keep_alive(self):
+        sock = socket.create_connection(("localhost", self.port), timeout=5)
+        request = self.raw_request('{"a": 1}', "Connection: keep-alive\r\n").replace("HTTP/1.1", "HTTP/1.0")
+        sock.sendall(request)
+        self.assertIn("Connection: keep-alive", sock.recv(65536))
+        sock.close()
+
+    def test_idle_connection_is_closed(self):
+        sock = socket.create_connection(("localhost", self.port), timeout=5)
+        sock.sendall(self.raw_request('{"a": 1}'))
+        self.assertEqual(1, self.read_all(sock).count("HTTP/1.1 422"))
+        sock.close()
+
+    def test_idle_clients_do_not_stall_others(self):
+        idle = []
+        for _ in range(self.server.threads):
+            conn = httplib.HTTPConnection("localhost", self.port, timeout=5)
+            conn.request("POST", "/method/", "{}")
+            conn.getresponse().read()
+            idle.append(conn)
+        started = time.time()
+        conn = httplib.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request("POST", "/method/", "{}")
+        self.assertEqual(api.INVALID_REQUEST, json.loads(conn.getresponse().read())["code"])
+        self.assertLess(time.time() - started, 2)
+        for conn in idle + [conn]:
+            conn.close()
+
+    def test_connection_closed_while_others_wait(self):
+        busy = []
+        for _ in range(self.server.threads):
+            conn = httplib.HTTPConnection("localhost", self.port, timeout=5)
+            conn.request("POST", "/slow/", "{}")
+            busy.append(conn)
+        while len(self.slow) < self.server.threads:
+            time.sleep(0.01)
+        waiting = httplib.HTTPConnection("localhost", self.port, timeout=5)
+        waiting.request("POST", "/method/", "{}")
+        while self.server.requests.qsize() == 0:
+            time.sleep(0.01)
+        self.release.set()
+        closed = [conn.getresponse().getheader("Connection") for conn in busy]
+        # The first answer frees a thread for the waiting connection.
+        self.assertIn("close", closed)
+        for conn in busy:
+            conn.close()
+        self.assertEqual(api.INVALID_REQUEST, json.loads(waiting.getresponse().read())["code"])
+        waiting.close()
+
+    def test_missing_content_length_closes_connection(self):
+        sock = socket.create_connection(("localhost", self.port), timeout=5)
+        sock.sendall("POST /method/ HTTP/1.1\r\nHost: localhost\r\n\r\n{}")
+        data = self.read_all(sock)
+        sock.close()
+        self.assertIn("HTTP/1.1 400", data)
+        self.assertIn("Connection: close", data)
+
+
+class TestPrefork(unittest.TestCase):
+    def setUp(self):
+        def pid_handler(request, ctx, store):
+            time.sleep(0.2)
+            return {"pid": os.getpid()}, api.OK
+
+        class Handler(api.MainHTTPHandler):
+            router = dict(api.MainHTTPHandler.router, pid=pid_handler)
+            max_requests = 1
+
+            def log_message(self, *args):
+                pass
+
+        server = api.ScoringHTTPServer(("localhost", 0), Handler)
+        self.port = server.server_address[1]
+        self.parent = os.fork()
+        if self.parent == 0:
+            code = 1
+            try:
+                signal.signal(signal.SIGUSR1, lambda signum, frame: None)
+                api.serve_prefork(server, 2)
+                try:
+                    os.waitpid(-1, os.WNOHANG)
+                except OSError, e:
+                    code = 0 if e.errno == errno.ECHILD else 1
+            finally:
+                os._exit(code)
+        server.server_close()
+
+    def tearDown(self):
+        try:
+            os.kill(self.parent, signal.SIGKILL)
+            os.waitpid(self.parent, 0)
+        except OSError:
+            pass
+
+    def get_pid(self, pids):
+        conn = httplib.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request("POST", "/pid/", "{}")
+        pids.append(json.loads(conn.getresponse().read())["response"]["pid"])
+        conn.close()
+
+    def get_pids(self):
+        pids = []
+        threads = [threading.Thread(target=self.get_pid, args=(pids,)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return pids
+
+    def test_workers_answer_and_stop(self):
+        # A busy worker does not accept, so the other answers the second request.
+        pids = set(self.get_pids())
+        self.assertEqual(2, len(pids))
+        self.assertNotIn(self.parent, pids)
+
+        os.kill(self.parent, signal.SIGUSR1)
+        time.sleep(0.05)
+        self.assertEqual(pids, set(self.get_pids()))
+        self.assertEqual((0, 0), os.waitpid(self.parent, os.WNOHANG))
+
+        os.kill(self.parent, signal.SIGTERM)
+        self.assertEqual(0, os.waitpid(self.parent, 0)[1])
+        for pid in pids:
+            with self.assertRaises(OSError):
+                os.kill(pid, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
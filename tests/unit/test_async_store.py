@@ -0,0 +1,106 @@
+import unittest
+import socket
+import sys
+import os
+from redis.exceptions import ConnectionError, ResponseError
+
+sys.path.append(os.path.join(os.getcwd(), ''))
+from eventloop import EventLoop, Future, Return, coroutine
+from store import AsyncStore, AsyncRedisStore, Deadline, INCOMPLETE, encode_command, parse_reply
+from tests.cases import cases
+
+
+class TestRespProtocol(unittest.TestCase):
+
+    @cases([
+        (('GET', 'key'), '*2\r\n$3\r\nGET\r\n$3\r\nkey\r\n'),
+        (('SET', u'k\xe9y', 1.5, 'EX', 60), '*5\r\n$3\r\nSET\r\n$4\r\nk\xc3\xa9y\r\n$3\r\n1.5\r\n$2\r\nEX\r\n$2\r\n60\r\n'),
+    ])
+    def test_encode_command(self, args, expected):
+        self.assertEqual(expected, encode_command(args))
+
+    @cases([
+        ('+OK\r\n', 'OK'),
+        (':42\r\n', 42),
+        ('$-1\r\n', None),
+        ('$5\r\nvalue\r\n', u'value'),
+        ('*2\r\n$1\r\na\r\n$-1\r\n', [u'a', None]),
+    ])
+    def test_parse_reply(self, buf, expected):
+        self.assertEqual((expected, len(buf)), parse_reply(buf))
+
+    @cases(['', '+OK', '$5\r\nval', '*2\r\n$1\r\na\r\n'])
+    def test_parse_incomplete_reply(self, buf):
+        self.assertIs(INCOMPLETE, parse_reply(buf)[0])
+
+    def test_parse_error_reply(self):
+        reply, _ = parse_reply('-ERR wrong\r\n')
+        self.assertIsInstance(reply, ResponseError)
+
+
+class TestCoroutine(unittest.TestCase):
+
+    def test_yield_futures(self):
+        pending = Future()
+
+        @coroutine
+        def add(x):
+            y = yield pending
+            values = yield [x, pending]
+            raise Return(sum(values) + y)
+
+        result = add(1)
+        self.assertFalse(result.done())
+        pending.set_result(2)
+        self.assertEqual(5, result.result())
+
+    def test_exception_is_propagated(self):
+        @coroutine
+        def fail():
+            yield None
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            fail().result()
+
+
+class TestAsyncStoreUnavailable(unittest.TestCase):
+    def setUp(self):
+        sock = socket.socket()
+        sock.bind(('localhost', 0))
+        self.port = sock.getsockname()[1]
+        sock.close()
+        self.loop = EventLoop(poll_interval=0.05)
+        self.redis_store = AsyncRedisStore(self.loop, port=self.port)
+        self.store = AsyncStore(self.redis_store, self.loop)
+
+    def test_redis_store_fails_with_connection_error(self):
+        with self.assertRaises(ConnectionError):
+            self.loop.run_until_complete(self.redis_store.get('key'))
+
+    @cases(['cache_get', 'get'])
+    def test_store_returns_none_after_attempts(self, method):
+        calls = []
+        get = self.redis_store.get
+
+        def counted_get(key):
+            calls.append(key)
+            return get(key)
+
+        self.redis_store.get = counted_get
+        self.assertIsNone(self.loop.run_until_complete(getattr(self.store, method)('key')))
+        self.assertEqual(AsyncStore.MAX_ATTEMPT, len(calls))
+
+    def test_get_many_returns_none_for_every_key(self):
+        self.assertEqual([None, None], self.loop.run_until_complete(self.store.get_many(['key_one', 'key_two'])))
+
+    def test_deadline_abandons_pending_reply(self):
+        self.redis_store.get = lambda key: Future()
+        self.assertIsNone(self.loop.run_until_complete(self.store.get('key', deadline=Deadline(0.05))))
+
+    def test_cache_set_returns_none(self):
+        self.assertIsNone(self.loop.run_until_complete(self.store.cache_set('key', 'value', 10)))
+
+
+if __name__ == "__main__":
+    unittest.main()
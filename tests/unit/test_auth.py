@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import unittest
+import sys
+import os
+from mock import patch
+
+sys.path.append(os.path.join(os.getcwd(), ''))
+import api
+from store import LOCAL_CACHE
+from tests.cases import cases
+
+
+def admin_token(hour):
+    return hashlib.sha512(hour.strftime("%Y%m%d%H") + api.ADMIN_SALT).hexdigest()
+
+
+def user_token(account, login):
+    return hashlib.sha512(account + login + api.SALT).hexdigest()
+
+
+class TestCheckAuth(unittest.TestCase):
+    def setUp(self):
+        api.AUTH_CACHE.items.clear()
+
+    def get_request(self, login, token, account="horns&hoofs"):
+        request = api.MethodRequest({"account": account, "login": login, "token": token,
+                                     "arguments": {}, "method": "online_score"})
+        request.valid_required_field()
+        return request
+
+    @cases([
+        ("h&f", user_token("horns&hoofs", "h&f")),
+        (u"h&f", unicode(user_token("horns&hoofs", "h&f"))),
+        ("admin", admin_token(datetime.datetime.now())),
+    ])
+    def test_valid_token(self, login, token):
+        self.assertTrue(api.check_auth(self.get_request(login, token)))
+
+    @cases([
+        ("h&f", ""),
+        ("h&f", "bad"),
+        ("h&f", user_token("horns&hoofs", "admin")),
+        ("admin", user_token("horns&hoofs", "admin")),
+        ("admin", admin_token(datetime.datetime.now() - datetime.timedelta(hours=2))),
+        (u"h&f", u"токен"),
+    ])
+    def test_invalid_token(self, login, token):
+        self.assertFalse(api.check_auth(self.get_request(login, token)))
+
+    def test_valid_token_is_cached(self):
+        LOCAL_CACHE.registry.reset()
+        token = user_token("horns&hoofs", "h&f")
+        self.assertTrue(api.check_auth(self.get_request("h&f", token)))
+        with patch("api.hashlib.sha512", wraps=hashlib.sha512) as sha512:
+            self.assertTrue(api.check_auth(self.get_request("h&f", token)))
+            self.assertEqual(0, sha512.call_count)
+            self.assertFalse(api.check_auth(self.get_request("h&f", token[:-1])))
+            self.assertEqual(1, sha512.call_count)
+        self.assertEqual((1, 2), tuple(LOCAL_CACHE.value(("auth", result)) for result in ("hit", "miss")))
+        self.assertEqual(0, LOCAL_CACHE.value(("score", "hit")) + LOCAL_CACHE.value(("score", "miss")))
+
+
+class TestAdminDigest(unittest.TestCase):
+
+    def test_hour_boundary(self):
+        digest = api.AdminDigest()
+        self.assertEqual(admin_token(datetime.datetime.now()), digest.get())
+        start, end, _ = digest.current
+        self.assertEqual(end, digest.next[0])
+        expected = admin_token(datetime.datetime.fromtimestamp(end + 1))
+        with patch("api.time.time", return_value=end + 1):
+            with patch("api.hashlib.sha512", wraps=hashlib.sha512) as sha512:
+                self.assertEqual(expected, digest.get())
+                self.assertEqual(1, sha512.call_count)
+        self.assertEqual((start, end), digest.hour_digest(datetime.datetime.fromtimestamp(start))[:2])
+
+
+if __name__ == "__main__":
+    unittest.main()
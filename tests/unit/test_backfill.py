@@ -0,0 +1,76 @@
+import hashlib
+import json
+import unittest
+import sys
+import os
+from cStringIO import StringIO
+
+sys.path.append(os.path.join(os.getcwd(), ''))
+import api
+from backfill import Backfill
+from store import Store, MemoryStore
+from tests.cases import cases
+
+
+def method_request(arguments):
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "arguments": arguments}
+    request["token"] = hashlib.sha512(request["account"] + request["login"] + api.SALT).hexdigest()
+    return request
+
+
+class TestBackfill(unittest.TestCase):
+    def run_lines(self, lines):
+        self.backfill = Backfill(Store(MemoryStore()), threads=4, chunk_size=3)
+        output = StringIO()
+        self.backfill.run(lines, output)
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_answers(self):
+        lines = [
+            json.dumps(method_request({"phone": "79175002040", "email": "a@b.ru"})),
+            "{not json",
+            "",
+            json.dumps({"body": method_request({"first_name": "a", "last_name": "b"})}),
+            json.dumps([1, 2]),
+            json.dumps(dict(method_request({}), token="bad")),
+        ]
+        self.assertEqual([
+            {"code": api.OK, "response": {"score": 3.0}},
+            {"code": api.BAD_REQUEST, "error": api.ERRORS[api.BAD_REQUEST]},
+            {"code": api.OK, "response": {"score": 0.5}},
+            {"code": api.INVALID_REQUEST, "error": "<Invalid request: expected an object>"},
+            {"code": api.FORBIDDEN, "error": "Forbidden"},
+        ], self.run_lines(lines))
+        self.assertEqual({api.OK: 2, api.BAD_REQUEST: 1, api.INVALID_REQUEST: 1, api.FORBIDDEN: 1},
+                         self.backfill.codes)
+
+    @cases([0, 1, 3, 50])
+    def test_order(self, count):
+        lines = [json.dumps(method_request({"phone": "79175002040", "email": "a@b.ru",
+                                            "first_name": str(i), "last_name": "b"})) for i in range(count)]
+        self.assertEqual([{"code": api.OK, "response": {"score": 3.5}}] * count, self.run_lines(lines))
+        self.assertEqual(count, self.backfill.requests)
+
+    def test_bounded_reading(self):
+        read = []
+
+        def lines():
+            for i in range(30):
+                read.append(i)
+                yield json.dumps(method_request({"first_name": "a", "last_name": "b"}))
+
+        class Output(object):
+            def __init__(self):
+                self.read_at_writes = []
+
+            def write(self, data):
+                self.read_at_writes.append(len(read))
+
+        output = Output()
+        Backfill(Store(MemoryStore()), threads=4, chunk_size=3).run(lines(), output)
+        self.assertEqual(10, len(output.read_at_writes))
+        self.assertTrue(all(count <= (number + 2) * 3 for number, count in enumerate(output.read_at_writes)))
+
+
+if __name__ == "__main__":
+    unittest.main()
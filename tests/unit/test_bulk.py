@@ -0,0 +1,99 @@
+import itertools
+from ast import literal_eval
+import random
+import unittest
+import sys
+import os
+from mock import MagicMock
+
+sys.path.append(os.path.join(os.getcwd(), ''))
+import api
+import bulk
+import scoring
+from store import Store, MemoryStore
+from tests.cases import cases
+
+
+VALUES = {
+    "phone": ["79175002040", 79175002040, "89175002040", None],
+    "email": ["fake@mail.ru", "fakemail.ru", None],
+    "first_name": ["Niels", 1, None],
+    "last_name": ["Bohr", None],
+    "birthday": ["01.01.1990", "01.01.1890", "XXX", None],
+    "gender": [0, 1, 2, 3, None],
+}
+
+
+class TestValidation(unittest.TestCase):
+
+    def test_same_as_online_score(self):
+        rows = [dict(zip(bulk.FIELDS, values)) for values in
+                itertools.product(*[VALUES[name] for name in bulk.FIELDS])]
+        columns = dict((name, [row[name] for row in rows]) for name in bulk.FIELDS)
+        valid, messages = bulk.validate_columns(columns)
+        method_request = MagicMock(is_admin=False)
+        for index, row in enumerate(rows):
+            method_request.arguments = dict((name, value) for name, value in row.items() if value is not None)
+            request, answer = api.validate_online_score(method_request, {})
+            self.assertEqual(answer is None, index not in messages, row)
+            if answer and answer[0].startswith("<Invalid fields: ["):
+                prefix = len("<Invalid fields: ")
+                self.assertEqual(sorted(literal_eval(answer[0][prefix:-1])),
+                                 sorted(literal_eval(messages[index][prefix:-1])), row)
+            if request:
+                self.assertEqual([getattr(request, name) for name in bulk.FIELDS],
+                                 [valid[name][index] for name in bulk.FIELDS])
+
+    def test_messages(self):
+        valid, messages = bulk.validate_columns({"phone": ["79175002040", "89175002040", "79175002040"],
+                                                 "email": ["a@b.ru", "a@b.ru", None]})
+        self.assertEqual({1: "<Invalid fields: {'phone': 'Telephone is not valid.'}>",
+                          2: "<Invalid fields: []>"}, messages)
+        self.assertEqual([None] * 3, valid["gender"])
+
+    @cases([{"phone": [], "ssn": []}, {"phone": ["79175002040"], "email": []}])
+    def test_bad_columns(self, columns):
+        with self.assertRaises(ValueError):
+            bulk.validate_columns(columns)
+
+
+class TestScoreColumns(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(1)
+        self.columns = dict((name, [rnd.choice(VALUES[name]) for _ in range(500)]) for name in bulk.FIELDS)
+
+    def expected(self):
+        method_request = MagicMock(is_admin=False)
+        scores = []
+        for row in zip(*[self.columns[name] for name in bulk.FIELDS]):
+            method_request.arguments = dict(zip(bulk.FIELDS, row))
+            request, answer = api.validate_online_score(method_request, {})
+            scores.append(request and scoring.calc_score(*[getattr(request, name) for name in bulk.FIELDS]))
+        return scores
+
+    @cases(["cache", "inline"])
+    def test_scores(self, mode):
+        store = Store(MemoryStore())
+        scores, errors = bulk.score_columns(store, self.columns, 64, scoring.Scorer(mode=mode))
+        self.assertEqual(self.expected(), scores)
+        self.assertEqual([score is None for score in scores], [error is not None for error in errors])
+        self.assertTrue(0 < errors.count(None) < 500)
+
+    def test_chunked_cache(self):
+        store = MagicMock()
+        store.cache_get_many.side_effect = lambda keys, deadline=None: ["2.5"] + [None] * (len(keys) - 1)
+        scores, errors = bulk.score_columns(store, self.columns, 64, scoring.Scorer(mode="cache"))
+        chunks = -(-errors.count(None) // 64)
+        self.assertEqual(chunks, store.cache_get_many.call_count)
+        self.assertEqual(chunks, store.cache_set_many.call_count)
+        self.assertTrue(all(len(call[0][0]) <= 64 for call in store.cache_get_many.call_args_list))
+        self.assertEqual(2.5, next(score for score in scores if score is not None))
+
+    def test_row_scorer(self):
+        scorer = scoring.Scorer(lambda *args: 1.0, mode="inline")
+        scores, errors = bulk.score_columns(MagicMock(), self.columns, scorer=scorer)
+        self.assertEqual([None if error else 1.0 for error in errors], scores)
+
+
+if __name__ == "__main__":
+    unittest.main()
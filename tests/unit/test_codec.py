@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+import sys
+import os
+from mock import patch
+
+sys.path.append(os.path.join(os.getcwd(), ''))
+import codec
+from tests.cases import cases
+
+
+class TestCodec(unittest.TestCase):
+
+    @cases(sorted(codec.BACKENDS))
+    def test_round_trip(self, name):
+        value = {"code": 200, "response": {"score": 3.5, "1": ["books", u"кино"], "url": "a/b"}}
+        data = codec.BACKENDS[name].dumps(value)
+        self.assertIsInstance(data, str)
+        self.assertEqual(value, json.loads(data))
+        self.assertEqual(value, codec.BACKENDS[name].loads(json.dumps(value)))
+
+    @cases(sorted(codec.BACKENDS))
+    def test_invalid_body(self, name):
+        with self.assertRaises(ValueError):
+            codec.BACKENDS[name].loads('{"login": ')
+
+    def test_auto_prefers_accelerated(self):
+        names = [name for name in codec.NAMES[1:] if name in codec.BACKENDS]
+        self.assertEqual(names[0], codec.get_codec().name)
+        self.assertEqual("json", codec.get_codec("json").name)
+
+    @cases(["ujson", "simplejson", "auto"])
+    def test_fallback_to_json(self, name):
+        with patch.dict(codec.BACKENDS, clear=True, json=codec.BACKENDS["json"]):
+            self.assertEqual("json", codec.get_codec(name).name)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            codec.get_codec("yaml")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 import functools
 import datetime
+import time
 import sys
 import os
 
@@ -81,6 +82,28 @@ class TestDateField(unittest.TestCase):
         with self.assertRaises(api.ValidationError):
             api.DateField().valid_value(value)
 
+    @cases(['18.06.2010', u'18.06.2010', '1.6.2010', ' 1.06.2010', '31.12.9999', '29.02.2012',
+            '29.02.2011', '00.01.2010', '01.00.2010', '01.13.2010', '32.01.2010', '01.01.0000',
+            '01.01.10000', '01.01.201', '01.01.2010 ', '01.01.2010\n', '001.01.2010', '1-1-2010',
+            u'\u0661.01.2010', ''])
+    def test_parse_date_as_strptime(self, value):
+        try:
+            expected = datetime.datetime.strptime(value, '%d.%m.%Y')
+        except ValueError:
+            expected = None
+        self.assertEqual(expected, api.parse_date(value))
+        self.assertEqual(expected, api.parse_date(value))
+
+    @cases(['01.01.2010 ' * 10000, '01.01.20100', 'x' * 100000])
+    def test_long_dates_not_memoized(self, value):
+        self.assertIsNone(api.parse_date(value))
+        self.assertNotIn(value, api.DATE_MEMO)
+
+    @cases([None, 20100618, ['18.06.2010'], {}])
+    def test_invalid_date_type(self, value):
+        with self.assertRaises(api.ValidationError):
+            api.DateField().valid_value(value)
+
 
 class TestBirthDayField(unittest.TestCase):
 
@@ -98,6 +121,11 @@ class TestBirthDayField(unittest.TestCase):
         with self.assertRaises(api.ValidationError):
             api.BirthDayField().valid_value(value)
 
+    def test_current_year(self):
+        current_year = api.CurrentYear()
+        self.assertEqual(datetime.datetime.now().year, current_year.get())
+        self.assertGreater(current_year.until, time.time())
+
 
 class TestGenderField(unittest.TestCase):
 
@@ -134,5 +162,53 @@ class TestClientIDsField(unittest.TestCase):
             api.ClientIDsField().valid_value(value)
 
 
+class TestCompiledValidation(unittest.TestCase):
+
+    def test_request_has_slots(self):
+        request = api.OnlineScoreRequest({"first_name": "a"})
+        request.valid_required_field()
+        self.assertFalse(hasattr(request, '__dict__'))
+        self.assertEqual("a", request.first_name)
+        self.assertIsNone(request.last_name)
+
+    @cases([
+        ({}, {"login": "This field is required.", "token": "This field is required.",
+              "arguments": "This field is required.", "method": "This field is required."}),
+        ({"login": "h&f", "token": "", "arguments": {}, "method": ""}, {"method": "This field cannot be empty."}),
+        ({"login": 1, "token": [], "arguments": [], "method": "m"},
+         {"login": "The field must be of string type.", "token": "The field must be of string type.",
+          "arguments": "The field must be a dictionary type."}),
+        ({"login": "h&f", "token": "t", "arguments": {}, "method": "m"}, {}),
+    ])
+    def test_method_request_errors(self, arguments, errors):
+        request = api.MethodRequest(arguments)
+        request.valid_required_field()
+        self.assertEqual(errors, request.error_field)
+
+    @cases([
+        {"phone": "79175002040", "email": "fake_emailmail.ru", "gender": 3, "birthday": "XXX"},
+        {"phone": 89175002040, "email": "", "gender": "1", "birthday": "01.01.1890", "first_name": 1},
+        {"client_ids": [], "date": "XXX"},
+        {"client_ids": ["1"], "date": ""},
+    ])
+    def test_errors_match_fields(self, arguments):
+        request_class = api.ClientsInterestsRequest if "client_ids" in arguments else api.OnlineScoreRequest
+        request = request_class(arguments)
+        request.valid_required_field()
+        errors = {}
+        for name, field in request_class.declared_defs.items():
+            value = arguments.get(name)
+            try:
+                if value is not None and (field.nullable or value not in ('', {}, [])):
+                    field.valid_value(value)
+                elif value is not None:
+                    raise api.ValidationError('This field cannot be empty.')
+                elif field.required:
+                    raise api.ValidationError('This field is required.')
+            except api.ValidationError, e:
+                errors[name] = e.args[0]
+        self.assertEqual(errors, request.error_field)
+
+
 if __name__ == "__main__":
     unittest.main()
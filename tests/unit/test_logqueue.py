@@ -0,0 +1,87 @@
+import json
+import logging
+import unittest
+import sys
+import os
+from cStringIO import StringIO
+from mock import patch
+
+sys.path.append(os.path.join(os.getcwd(), ''))
+import logqueue
+from tests.cases import cases
+
+
+class TestQueueHandler(unittest.TestCase):
+    def setUp(self):
+        self.stream = StringIO()
+        self.target = logging.StreamHandler(self.stream)
+        self.target.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        self.logger = logging.getLogger("test_logqueue")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+
+    def lines(self):
+        return self.stream.getvalue().splitlines()
+
+    def test_close_writes_queued_records(self):
+        handler = logqueue.QueueHandler(self.target, size=100, batch=7)
+        self.logger.addHandler(handler)
+        for i in range(50):
+            self.logger.info("request %s", i)
+        handler.close()
+        self.assertEqual(["INFO request %s" % i for i in range(50)], self.lines())
+        self.assertEqual(0, handler.dropped)
+
+    def test_level_of_wrapped_handler(self):
+        self.target.setLevel(logging.WARNING)
+        handler = logqueue.QueueHandler(self.target)
+        self.logger.addHandler(handler)
+        self.logger.info("skipped")
+        self.logger.warning("written")
+        handler.close()
+        self.assertEqual(["WARNING written"], self.lines())
+
+    def test_full_queue_drops_records(self):
+        handler = logqueue.QueueHandler(self.target, size=2)
+        self.logger.addHandler(handler)
+        with patch.object(handler, "write_records"):
+            for i in range(5):
+                self.logger.info("request %s", i)
+        self.assertEqual(3, handler.dropped)
+        self.assertEqual(2, handler.queue.qsize())
+
+    def test_writer_started_in_every_process(self):
+        handler = logqueue.QueueHandler(self.target)
+        self.logger.addHandler(handler)
+        self.logger.info("parent")
+        thread = handler.thread
+        with patch("logqueue.os.getpid", return_value=handler.pid + 1):
+            self.logger.info("child")
+            self.assertIsNot(thread, handler.thread)
+            handler.close()
+        self.assertIn("INFO child", self.lines())
+
+
+class TestJSONFormatter(unittest.TestCase):
+
+    @cases([
+        ({"request_id": "42", "code": 200}, {"request_id": "42", "code": 200}),
+        ({"request_id": "42", "path": "/method/", "user": "x"}, {"request_id": "42", "path": "/method/"}),
+        ({}, {}),
+    ])
+    def test_format(self, extra, fields):
+        record = logging.LogRecord("api", logging.INFO, __file__, 1, "%s %s", ("42", '{"code": 200}'), None)
+        record.__dict__.update(extra)
+        data = json.loads(logqueue.JSONFormatter().format(record))
+        self.assertEqual('42 {"code": 200}', data.pop("message"))
+        self.assertEqual("INFO", data.pop("level"))
+        self.assertTrue(data.pop("time"))
+        self.assertEqual(fields, data)
+
+
+if __name__ == "__main__":
+    unittest.main()
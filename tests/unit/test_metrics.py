@@ -0,0 +1,59 @@
+import threading
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.join(os.getcwd(), ''))
+import metrics
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.requests = self.registry.counter("requests_total", "Requests", ("method", "code"))
+        self.in_flight = self.registry.gauge("in_flight", "Requests in progress")
+        self.latency = self.registry.histogram("latency_seconds", "Latency", ("method",), buckets=(0.1, 1))
+
+    def test_counter_threads(self):
+        def work():
+            for _ in range(1000):
+                self.requests.inc(("online_score", "200"))
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(8000, self.requests.value(("online_score", "200")))
+        self.assertEqual(0, self.requests.value(("online_score", "403")))
+
+    def test_gauge(self):
+        self.in_flight.inc()
+        self.in_flight.inc()
+        self.in_flight.dec()
+        self.assertEqual(1, self.in_flight.value())
+
+    def test_histogram(self):
+        for value in [0.05, 0.1, 0.5, 3]:
+            self.latency.observe(("m",), value)
+        rendered = self.registry.render().splitlines()
+        for line in ['latency_seconds_bucket{method="m",le="0.1"} 2',
+                     'latency_seconds_bucket{method="m",le="1.0"} 3',
+                     'latency_seconds_bucket{method="m",le="+Inf"} 4',
+                     'latency_seconds_sum{method="m"} 3.65',
+                     'latency_seconds_count{method="m"} 4']:
+            self.assertIn(line, rendered)
+
+    def test_render(self):
+        self.requests.inc(("online_score", "200"), 2)
+        self.requests.inc(('x"y', "403"))
+        rendered = self.registry.render()
+        self.assertTrue(rendered.startswith("# HELP requests_total Requests\n# TYPE requests_total counter\n"))
+        self.assertIn('requests_total{method="online_score",code="200"} 2\n', rendered)
+        self.assertIn('requests_total{method="x\\"y",code="403"} 1\n', rendered)
+        self.assertIn("# TYPE in_flight gauge\n", rendered)
+        self.assertIn("# TYPE latency_seconds histogram\n", rendered)
+
+
+if __name__ == "__main__":
+    unittest.main()
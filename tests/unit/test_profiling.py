@@ -0,0 +1,80 @@
+import datetime
+import hashlib
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from mock import MagicMock
+
+sys.path.append(os.path.join(os.getcwd(), ''))
+import api
+import profiling
+from tests.cases import cases
+
+
+class TestStage(unittest.TestCase):
+
+    @cases([None, {}, {"timings": None}])
+    def test_without_timings(self, ctx):
+        self.assertIs(profiling.NO_STAGE, profiling.stage(ctx, "read"))
+        with profiling.stage(ctx, "read"):
+            pass
+
+    def test_stages_are_summed(self):
+        ctx = {"timings": profiling.Timings()}
+        for _ in range(2):
+            with profiling.stage(ctx, "store"):
+                time.sleep(0.01)
+        with self.assertRaises(ValueError):
+            with profiling.stage(ctx, "decode"):
+                raise ValueError()
+        self.assertEqual(["decode", "store"], sorted(ctx["timings"]))
+        self.assertGreaterEqual(ctx["timings"]["store"], 0.02)
+        self.assertRegexpMatches(ctx["timings"].format(), r"^decode=\d+\.\d\dms store=\d+\.\d\dms$")
+
+    def test_timed_store(self):
+        timings = profiling.Timings()
+        store = MagicMock()
+        store.cache_get.return_value = "3"
+        timed = profiling.TimedStore(store, timings)
+        self.assertEqual("3", timed.cache_get("key", deadline=None))
+        store.cache_get.assert_called_once_with("key", deadline=None)
+        self.assertIn("store", timings)
+
+    def test_method_handler_stages(self):
+        request = {"account": "horns&hoofs", "login": "admin", "method": "online_score", "arguments": {}}
+        request["token"] = hashlib.sha512(datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT).hexdigest()
+        ctx = {"timings": profiling.Timings()}
+        _, code = api.method_handler({"body": request, "headers": {}}, ctx, MagicMock())
+        self.assertEqual(api.OK, code)
+        self.assertEqual(["auth", "validate"], sorted(ctx["timings"]))
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    @cases([(0, False), (1, True)])
+    def test_sample(self, rate, sampled):
+        self.assertEqual(sampled, profiling.Profiler(rate).sample())
+
+    def test_dump_sums_calls(self):
+        profiler = profiling.Profiler(1, os.path.join(self.dir, "api.prof"))
+        self.assertIsNone(profiler.dump())
+        for i in range(3):
+            self.assertEqual(i * 2, profiler.runcall(lambda x: x * 2, i))
+        path = profiler.dump()
+        self.assertEqual(os.path.join(self.dir, "api.prof.%d" % os.getpid()), path)
+        self.assertEqual(3, profiler.samples)
+        stats = pstats.Stats(path)
+        self.assertIn(3, [value[1] for key, value in stats.stats.items() if key[2] == "<lambda>"])
+
+
+if __name__ == "__main__":
+    unittest.main()
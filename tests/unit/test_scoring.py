@@ -0,0 +1,200 @@
+import unittest
+import threading
+import time
+import sys
+import os
+from mock import MagicMock, patch
+
+sys.path.append(os.path.join(os.getcwd(), ''))
+import scoring
+import async_api
+from eventloop import EventLoop, Future, resolved
+from store import Deadline
+from tests.cases import cases
+
+
+APPLICANT = {"phone": "79175002040", "email": "fake@mail.ru", "first_name": "a", "last_name": "b"}
+
+
+@scoring.cost(scoring.EXPENSIVE)
+def expensive_score(*args, **kwargs):
+    return 5.0
+
+
+class TestScorer(unittest.TestCase):
+    def setUp(self):
+        self.store = MagicMock()
+        self.store.cache_get.return_value = None
+        self.store.cache_get_many.return_value = [None, "2.5"]
+
+    def test_cache_mode(self):
+        scorer = scoring.Scorer(mode="cache")
+        self.assertEqual(3.5, scorer.score(self.store, **APPLICANT))
+        self.store.cache_get.assert_called_once_with(scoring.get_score_key("79175002040", None, "a", "b"),
+                                                     deadline=None)
+        self.assertEqual(1, self.store.cache_set.call_count)
+        self.store.cache_get.return_value = "2.5"
+        self.assertEqual(2.5, scorer.score(self.store, **APPLICANT))
+
+    @cases([(False, 0), (True, 1)])
+    def test_inline_mode(self, cache_writes, writes):
+        scorer = scoring.Scorer(mode="inline", cache_writes=cache_writes)
+        self.assertEqual(3.5, scorer.score(self.store, **APPLICANT))
+        self.assertEqual([3.5, 1.5], scorer.score_many(self.store, [APPLICANT, {"phone": "79175002040"}]))
+        self.assertEqual(0, self.store.cache_get.call_count)
+        self.assertEqual(0, self.store.cache_get_many.call_count)
+        self.assertEqual(writes, self.store.cache_set.call_count)
+        self.assertEqual(writes, self.store.cache_set_many.call_count)
+
+    @cases([
+        (scoring.calc_score, "auto", True),
+        (expensive_score, "auto", False),
+        (lambda *args: 1.0, "auto", False),
+        (expensive_score, "inline", True),
+        (scoring.calc_score, "cache", False),
+    ])
+    def test_mode_by_cost(self, func, mode, inline):
+        self.assertEqual(inline, scoring.Scorer(func, mode).inline)
+
+    def test_score_many_reads_through(self):
+        scorer = scoring.Scorer(expensive_score, mode="auto")
+        self.assertEqual([5.0, 2.5], scorer.score_many(self.store, [APPLICANT, {"phone": "79175002040"}]))
+        self.assertEqual(1, self.store.cache_set_many.call_count)
+
+    def test_module_scorer(self):
+        with patch("scoring.SCORER", scoring.Scorer(expensive_score, mode="inline")):
+            self.assertEqual(5.0, scoring.get_score(self.store, "79175002040", "fake@mail.ru"))
+            self.assertEqual([5.0], scoring.get_scores(self.store, [APPLICANT]))
+
+    def test_load_scorer(self):
+        self.assertIs(scoring.calc_score, scoring.load_scorer("scoring:calc_score"))
+        scorer = scoring.load_scorer("tests.unit.test_scoring:expensive_score")
+        self.assertEqual((scoring.EXPENSIVE, 5.0), (scorer.cost, scorer()))
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        scoring.SINGLE_FLIGHT.registry.reset()
+
+    def run_concurrently(self, func, count=5):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(func())) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for _ in range(100):
+            if scoring.SINGLE_FLIGHT.value(("follower",)) == count - 1:
+                break
+            time.sleep(0.01)
+        return threads, results
+
+    def test_shared_call(self):
+        flights = scoring.SingleFlight()
+        release = threading.Event()
+
+        def upper(key):
+            release.wait()
+            return key.upper()
+        func = MagicMock(side_effect=upper)
+        threads, results = self.run_concurrently(lambda: flights.do("key", func, ("key",)))
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(["KEY"] * 5, results)
+        self.assertEqual(1, func.call_count)
+        self.assertEqual(4, scoring.SINGLE_FLIGHT.value(("follower",)))
+        self.assertEqual({}, flights.flights)
+        self.assertEqual("OTHER", flights.do("other", func, ("other",)))
+        self.assertEqual(2, func.call_count)
+
+    def test_shared_error(self):
+        flights = scoring.SingleFlight()
+        release = threading.Event()
+
+        def fail():
+            release.wait()
+            raise ValueError("fail")
+
+        def call():
+            try:
+                flights.do("key", fail)
+            except ValueError, e:
+                return str(e)
+        threads, results = self.run_concurrently(call, 3)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(["fail"] * 3, results)
+        self.assertEqual(1, scoring.SINGLE_FLIGHT.value(("leader",)))
+
+    def test_scorer(self):
+        release = threading.Event()
+        store = MagicMock()
+        store.cache_get.side_effect = lambda key, deadline=None: release.wait() and None
+        scorer = scoring.Scorer(mode="cache", single_flight=True)
+        threads, results = self.run_concurrently(lambda: scorer.score(store, **APPLICANT))
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([3.5] * 5, results)
+        self.assertEqual(1, store.cache_get.call_count)
+        self.assertEqual(1, store.cache_set.call_count)
+
+    def test_async(self):
+        read = Future()
+        store = MagicMock()
+        store.cache_get.return_value = read
+        store.cache_set.return_value = resolved(True)
+        with patch("scoring.SCORER", scoring.Scorer(mode="cache", single_flight=True)):
+            futures = [async_api.get_score(store, "79175002040", "fake@mail.ru") for _ in range(3)]
+            self.assertFalse(any(future.done() for future in futures))
+            read.set_result("2.5")
+        self.assertEqual([2.5] * 3, [future.result() for future in futures])
+        self.assertEqual(1, store.cache_get.call_count)
+        self.assertEqual({}, async_api.FLIGHTS)
+
+    def test_follower_deadline(self):
+        flights = scoring.SingleFlight()
+        release = threading.Event()
+        leader = threading.Thread(target=flights.do, args=("key", release.wait))
+        leader.start()
+        while not flights.flights:
+            time.sleep(0.001)
+        started = time.time()
+        self.assertEqual("fallback", flights.do("key", None, (), Deadline(0.05), lambda: "fallback"))
+        self.assertTrue(time.time() - started < 1)
+        self.assertEqual(1, scoring.SINGLE_FLIGHT.value(("timeout",)))
+        release.set()
+        leader.join()
+
+    def test_scorer_deadline(self):
+        release = threading.Event()
+        store = MagicMock()
+        store.cache_get.side_effect = lambda key, deadline=None: release.wait() and None
+        scorer = scoring.Scorer(mode="cache", single_flight=True)
+        leader = threading.Thread(target=scorer.score, args=(store,), kwargs=APPLICANT)
+        leader.start()
+        while not scorer.flights.flights:
+            time.sleep(0.001)
+        self.assertEqual(3.5, scorer.score(store, deadline=Deadline(0.05), **APPLICANT))
+        self.assertEqual(1, store.cache_get.call_count)
+        release.set()
+        leader.join()
+
+    def test_async_deadline(self):
+        loop = EventLoop(poll_interval=0.01)
+        read = Future()
+        store = MagicMock(loop=loop)
+        store.cache_get.return_value = read
+        store.cache_set.return_value = resolved(True)
+        with patch("scoring.SCORER", scoring.Scorer(mode="cache", single_flight=True)):
+            leader = async_api.get_score(store, "79175002040", "fake@mail.ru")
+            follower = async_api.get_score(store, "79175002040", "fake@mail.ru", deadline=Deadline(0.02))
+            self.assertEqual(3.0, loop.run_until_complete(follower))
+            self.assertFalse(leader.done())
+            read.set_result("2.5")
+        self.assertEqual(2.5, leader.result())
+        self.assertEqual(1, store.cache_get.call_count)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,11 +5,14 @@ import functools
 import sys
 import os
 import time
+import threading
+import redis
 from redis.exceptions import TimeoutError, ConnectionError
-from mock import MagicMock
+from mock import MagicMock, patch
 
 sys.path.append(os.path.join(os.getcwd(), ''))
-from store import Store, RedisStore
+from store import Store, RedisStore, MemoryStore, ShardedStore, HashRing, LocalCache, CachedStore, WriteBehindStore, RetryPolicy, CircuitBreaker, Deadline
+from store import STORE_RESULTS, STORE_RETRIES, WRITE_BEHIND, LOCAL_CACHE
 from tests.cases import cases
 
 
@@ -72,6 +75,40 @@ class TestStore(unittest.TestCase):
         with self.assertRaises(ConnectionError):
             redis_store.set('key', 'value', 10)
 
+    def test_metrics(self):
+        redis_store = MagicMock()
+        redis_store.get.side_effect = [ConnectionError(), "1", None, ConnectionError(), ConnectionError()]
+        redis_store.get_many.return_value = ["1", None, "2"]
+        store = Store(redis_store, cache_retry_policy=RetryPolicy(2, base=0), breaker=CircuitBreaker(100))
+        before = [STORE_RESULTS.value(("cache_get", result)) for result in ("hit", "miss", "error")]
+        before += [STORE_RESULTS.value(("cache_get_many", result)) for result in ("hit", "miss")]
+        before += [STORE_RETRIES.value(("cache_get",))]
+        for _ in range(3):
+            store.cache_get("key")
+        store.cache_get_many(["a", "b", "c"])
+        after = [STORE_RESULTS.value(("cache_get", result)) for result in ("hit", "miss", "error")]
+        after += [STORE_RESULTS.value(("cache_get_many", result)) for result in ("hit", "miss")]
+        after += [STORE_RETRIES.value(("cache_get",))]
+        self.assertEqual([1, 1, 1, 2, 1, 2], [a - b for a, b in zip(after, before)])
+
+    @cases([[], ['key_one'], ['key_one', 'key_two', 'key_three']])
+    def test_ok_store_get_many(self, keys):
+        for key in keys:
+            self.store.cache_set(key, key + '_value', 1)
+        self.assertEqual([key + '_value' for key in keys], self.store.get_many(keys))
+
+    def test_ok_store_cache_set_many(self):
+        items = [('key_one', 'value_one'), ('key_two', 'value_two')]
+        self.assertTrue(self.store.cache_set_many(items, 1))
+        self.assertEqual(['value_one', 'value_two'], self.store.cache_get_many(['key_one', 'key_two']))
+
+    def test_redis_connection_error_get_many(self):
+        redis_store = RedisStore()
+        redis_store.get_many = MagicMock(side_effect=ConnectionError())
+        store = Store(redis_store)
+        self.assertEqual([None, None], store.get_many(["key_one", "key_two"]))
+        self.assertEqual(redis_store.get_many.call_count, Store.MAX_ATTEMPT)
+
     def test_redis_timeout_error(self):
         redis_store = RedisStore()
         redis_store.get = MagicMock(side_effect=TimeoutError())
@@ -87,5 +124,346 @@ class TestStore(unittest.TestCase):
             redis_store.set('key', 'value', 10)
 
 
+class TestRetryPolicy(unittest.TestCase):
+
+    @cases([(1, []), (3, [0.05, 0.1]), (5, [0.05, 0.1, 0.2, 0.2])])
+    def test_delays_are_capped(self, tries, limits):
+        delays = list(RetryPolicy(tries, base=0.05, cap=0.2).delays())
+        self.assertEqual(len(limits), len(delays))
+        self.assertTrue(all(0 <= delay <= limit for delay, limit in zip(delays, limits)))
+
+    def test_budget(self):
+        for _ in range(100):
+            self.assertTrue(sum(RetryPolicy(10, base=0.1, cap=1, budget=0.3).delays()) <= 0.3)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_open_and_reset(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=0.1)
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.1)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.success()
+        self.assertTrue(breaker.allow())
+
+    def test_store_skips_cache_while_open(self):
+        redis_store = RedisStore()
+        redis_store.get = MagicMock(side_effect=ConnectionError())
+        store = Store(redis_store, breaker=CircuitBreaker(threshold=1, reset_timeout=60))
+        self.assertIsNone(store.cache_get("key"))
+        self.assertIsNone(store.cache_get("key"))
+        self.assertEqual(Store.MAX_ATTEMPT, redis_store.get.call_count)
+        self.assertIsNone(store.get("key"))
+        self.assertEqual(2 * Store.MAX_ATTEMPT, redis_store.get.call_count)
+
+
+class TestDeadline(unittest.TestCase):
+
+    def test_expired_deadline_skips_store(self):
+        redis_store = MagicMock()
+        store = Store(redis_store)
+        deadline = Deadline(0)
+        self.assertIsNone(store.get("key", deadline=deadline))
+        self.assertIsNone(store.cache_get("key", deadline=deadline))
+        self.assertIsNone(store.cache_set("key", "value", 10, deadline=deadline))
+        self.assertEqual([None, None], store.get_many(["key_one", "key_two"], deadline=deadline))
+        self.assertFalse(redis_store.method_calls)
+        self.assertFalse(store.breaker.failures)
+
+    def test_no_retry_past_deadline(self):
+        redis_store = RedisStore()
+        redis_store.get = MagicMock(side_effect=TimeoutError())
+        store = Store(redis_store, retry_policy=RetryPolicy(10, base=1, cap=1))
+        start = time.time()
+        self.assertIsNone(store.get("key", deadline=Deadline(0.5)))
+        self.assertTrue(time.time() - start < 0.5)
+
+
+class TestRedisStorePool(unittest.TestCase):
+
+    def test_default_pool(self):
+        redis_store = RedisStore(timeout=0.5)
+        self.assertIsInstance(redis_store.pool, redis.ConnectionPool)
+        self.assertEqual(0.5, redis_store.pool.connection_kwargs["socket_connect_timeout"])
+
+    def test_bounded_pool(self):
+        redis_store = RedisStore(max_connections=2, pool_timeout=0.05, keepalive=True, connect_timeout=1)
+        self.assertIsInstance(redis_store.pool, redis.BlockingConnectionPool)
+        self.assertTrue(redis_store.pool.connection_kwargs["socket_keepalive"])
+        connections = [redis_store.pool.get_connection('GET') for _ in range(2)]
+        with self.assertRaises(ConnectionError):
+            redis_store.pool.get_connection('GET')
+        for connection in connections:
+            redis_store.pool.release(connection)
+
+    def test_unix_socket(self):
+        redis_store = RedisStore(unix_socket='/tmp/redis.sock', db=1)
+        self.assertIs(redis.UnixDomainSocketConnection, redis_store.pool.connection_class)
+        self.assertEqual('/tmp/redis.sock', redis_store.pool.connection_kwargs["path"])
+
+
+class TestLocalCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        LOCAL_CACHE.registry.reset()
+        cache = LocalCache(max_size=2)
+        cache.set('key_one', 'value_one')
+        cache.set('key_two', 'value_two')
+        cache.get('key_one')
+        cache.set('key_three', 'value_three')
+        self.assertIsNone(cache.get('key_two'))
+        self.assertEqual('value_one', cache.get('key_one'))
+        self.assertEqual('value_three', cache.get('key_three'))
+        self.assertEqual({"size": 2, "hits": 3, "misses": 1, "evictions": 1}, cache.stats())
+        self.assertEqual((3, 1, 1), tuple(LOCAL_CACHE.value(("score", result)) for result in ("hit", "miss", "eviction")))
+
+    @cases([(0.1, 60), (60, 0.1)])
+    def test_expire(self, expire, ttl):
+        cache = LocalCache(ttl=ttl)
+        cache.set('key', 'value', expire)
+        self.assertEqual('value', cache.get('key'))
+        time.sleep(0.15)
+        self.assertIsNone(cache.get('key'))
+
+    def test_cached_store(self):
+        store = MagicMock()
+        store.cache_get.return_value = 'value'
+        store.cache_get_many.return_value = ['value_two', None]
+        cached_store = CachedStore(store, LocalCache())
+
+        self.assertEqual('value', cached_store.cache_get('key'))
+        self.assertEqual('value', cached_store.cache_get('key'))
+        self.assertEqual(1, store.cache_get.call_count)
+
+        cached_store.cache_set('key_one', 'value_one', 10)
+        store.cache_set.assert_called_once_with('key_one', 'value_one', 10, deadline=None)
+        self.assertEqual(['value_one', 'value_two', None],
+                         cached_store.cache_get_many(['key_one', 'key_two', 'key_three']))
+        store.cache_get_many.assert_called_once_with(['key_two', 'key_three'], deadline=None)
+
+        cached_store.get('key')
+        store.get.assert_called_once_with('key')
+
+
+
+class TestWriteBehindStore(unittest.TestCase):
+    def setUp(self):
+        WRITE_BEHIND.registry.reset()
+        self.store = MagicMock()
+        self.store.cache_set_many.return_value = True
+
+    def written(self):
+        return [(call[0][0], call[0][1]) for call in self.store.cache_set_many.call_args_list]
+
+    def test_coalesce(self):
+        store = WriteBehindStore(self.store, interval=60)
+        store.cache_set("key_one", 1, 60)
+        store.cache_set("key_two", 2, 60)
+        store.cache_set("key_one", 3, 60)
+        self.assertEqual(3, store.cache_get("key_one"))
+        self.assertFalse(self.store.cache_set_many.called)
+        store.flush()
+        self.assertEqual([([("key_one", 3), ("key_two", 2)], 60)], self.written())
+        self.assertEqual(1, WRITE_BEHIND.value(("coalesced",)))
+        self.assertEqual(2, WRITE_BEHIND.value(("written",)))
+
+    def test_group_by_expire(self):
+        store = WriteBehindStore(self.store, interval=60)
+        store.cache_set_many([("key_one", 1), ("key_two", 2)], 60)
+        store.cache_set("key_three", 3, 10)
+        store.flush()
+        self.assertEqual([([("key_one", 1), ("key_two", 2)], 60), ([("key_three", 3)], 10)], self.written())
+
+    @cases([(3, 60), (100, 0.01)])
+    def test_background_flush(self, batch_size, interval):
+        store = WriteBehindStore(self.store, batch_size, interval)
+        store.cache_set_many([("k%d" % i, i) for i in range(3)], 60)
+        for _ in range(100):
+            if self.store.cache_set_many.called:
+                break
+            time.sleep(0.01)
+        self.assertEqual([([("k0", 0), ("k1", 1), ("k2", 2)], 60)], self.written())
+
+    def test_backpressure(self):
+        store = WriteBehindStore(self.store, interval=60, max_pending=2)
+        store.cache_set_many([("k%d" % i, i) for i in range(4)], 60)
+        store.cache_set("k0", 10, 60)
+        store.flush()
+        self.assertEqual([([("k0", 10), ("k1", 1)], 60)], self.written())
+        self.assertEqual(2, WRITE_BEHIND.value(("dropped",)))
+
+    def test_failed_write(self):
+        self.store.cache_set_many.return_value = None
+        store = WriteBehindStore(self.store, interval=60)
+        store.cache_set("key", 1, 60)
+        store.flush()
+        self.assertEqual(1, WRITE_BEHIND.value(("failed",)))
+
+    def test_read_pending(self):
+        self.store.cache_get_many.return_value = ["stored"]
+        store = WriteBehindStore(self.store, interval=60)
+        store.cache_set("key_one", 1, 60)
+        self.assertEqual([1, "stored"], store.cache_get_many(["key_one", "key_two"]))
+        self.store.cache_get_many.assert_called_once_with(["key_two"], deadline=None)
+        store.get("key")
+        self.store.get.assert_called_once_with("key")
+
+
+class TestMemoryStore(unittest.TestCase):
+
+    @cases([("value", "value"), (u"\u0444", u"\u0444"), (3.5, "3.5"), (42, "42"), ('["books"]', '["books"]')])
+    def test_set_get(self, value, expected):
+        store = MemoryStore()
+        self.assertTrue(store.set("key", value))
+        self.assertEqual(expected, store.get("key"))
+        self.assertIsNone(store.get("other"))
+
+    def test_bulk(self):
+        store = MemoryStore()
+        self.assertTrue(store.set_many([("key_one", "1"), ("key_two", "2")], 60))
+        self.assertEqual(["1", None, "2"], store.get_many(["key_one", "key_three", "key_two"]))
+        self.assertEqual([], store.get_many([]))
+
+    def test_expire(self):
+        store = MemoryStore()
+        store.set("short", "value", 0.1)
+        store.set("long", "value", 60)
+        store.set("forever", "value")
+        time.sleep(0.15)
+        self.assertIsNone(store.get("short"))
+        self.assertEqual([None, "value", "value"], store.get_many(["short", "long", "forever"]))
+        store.set("other", "value")
+        self.assertEqual(3, len(store))
+        self.assertEqual([(store.items["long"][1], "long")], store.expiry)
+
+    def test_overwrite_keeps_new_expiry(self):
+        store = MemoryStore()
+        store.set("key", "old", 0.1)
+        store.set("key", "new", 60)
+        time.sleep(0.15)
+        store.set("other", "value")
+        self.assertEqual("new", store.get("key"))
+
+    def test_heap_is_compacted(self):
+        store = MemoryStore()
+        for i in range(5000):
+            store.set("key", str(i), 60)
+        self.assertEqual("4999", store.get("key"))
+        self.assertLessEqual(len(store.expiry), 2 * len(store) + 1024)
+
+    def test_store_backend(self):
+        store = Store(MemoryStore())
+        store.cache_set("uid:1", 3.0, 60)
+        self.assertEqual(3.0, float(store.cache_get("uid:1")))
+        self.assertEqual(["3.0", None], store.get_many(["uid:1", "i:1"]))
+
+
+
+class TestHashRing(unittest.TestCase):
+    keys = ["uid:%d" % i for i in range(10000)]
+
+    def test_balance(self):
+        ring = HashRing(["a", "b", "c", "d"])
+        counts = {}
+        for key in self.keys:
+            node = ring.node(key)
+            counts[node] = counts.get(node, 0) + 1
+        self.assertEqual(["a", "b", "c", "d"], sorted(counts))
+        for count in counts.values():
+            self.assertTrue(1500 < count < 3500, counts)
+
+    def test_add_moves_keys_to_new_node_only(self):
+        ring = HashRing(["a", "b", "c"])
+        before = dict((key, ring.node(key)) for key in self.keys)
+        ring.add("d")
+        moved = [key for key in self.keys if ring.node(key) != before[key]]
+        self.assertTrue(0.15 < float(len(moved)) / len(self.keys) < 0.35)
+        self.assertEqual(set(["d"]), set(ring.node(key) for key in moved))
+        ring.remove("d")
+        self.assertEqual(before, dict((key, ring.node(key)) for key in self.keys))
+
+    @cases(["uid:1", u"uid:\u0444", "i:42"])
+    def test_stable_node(self, key):
+        self.assertEqual(HashRing(["a", "b"]).node(key), HashRing(["a", "b"]).node(key))
+
+    def test_empty_ring(self):
+        with self.assertRaises(KeyError):
+            HashRing().node("key")
+
+
+class TestShardedStore(unittest.TestCase):
+    def setUp(self):
+        self.nodes = [("node%d" % i, MemoryStore()) for i in range(3)]
+        self.store = ShardedStore(self.nodes)
+
+    def test_get_set(self):
+        self.assertTrue(self.store.set("key", "value", 60))
+        self.assertEqual("value", self.store.get("key"))
+        self.assertEqual(["value"], [node.get("key") for _, node in self.nodes if node.get("key")])
+
+    @cases([[], ["k0"], ["k%d" % i for i in range(50)]])
+    def test_bulk(self, keys):
+        self.assertTrue(self.store.set_many([(key, key.upper()) for key in keys], 60))
+        self.assertEqual([key.upper() for key in keys] + [None], self.store.get_many(keys + ["missing"]))
+        self.assertEqual(len(keys), sum(len(node) for _, node in self.nodes))
+
+    def test_bulk_error(self):
+        keys = ["k%d" % i for i in range(50)]
+        self.nodes[1][1].get_many = MagicMock(side_effect=ConnectionError())
+        with self.assertRaises(ConnectionError):
+            self.store.get_many(keys)
+        self.assertEqual([None] * 50, Store(self.store, retry_policy=RetryPolicy(1)).get_many(keys))
+
+    def test_one_pool_per_process(self):
+        from multiprocessing.pool import ThreadPool
+
+        def slow_pool(*args):
+            time.sleep(0.05)
+            return ThreadPool(*args)
+
+        keys = ["k%d" % i for i in range(50)]
+        with patch("store.ThreadPool", side_effect=slow_pool) as pool_class:
+            threads = [threading.Thread(target=self.store.get_many, args=(keys,)) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(1, pool_class.call_count)
+
+    def test_add_node(self):
+        keys = ["k%d" % i for i in range(100)]
+        self.store.set_many([(key, key) for key in keys])
+        node = MemoryStore()
+        self.store.add_node("node3", node)
+        self.assertEqual(keys, self.store.get_many(keys))
+        self.assertEqual(keys, [self.store.get(key) for key in keys])
+        self.assertEqual(0, len(node))
+        moved = [key for key in keys if self.store.previous_node(key) is not None]
+        self.assertTrue(0 < len(moved) < 50)
+        self.assertTrue(self.store.set(moved[0], "new"))
+        self.assertEqual("new", self.store.get(moved[0]))
+        self.assertEqual((1, "new"), (len(node), node.get(moved[0])))
+
+    def test_previous_nodes(self):
+        self.store.set_many([("k%d" % i, "v%d" % i) for i in range(100)])
+        nodes = self.nodes[1:] + [("node3", MemoryStore())]
+        store = ShardedStore(nodes, previous=self.nodes)
+        self.assertEqual(["v%d" % i for i in range(100)] + [None],
+                         store.get_many(["k%d" % i for i in range(100)] + ["missing"]))
+        self.assertEqual("v7", store.get("k7"))
+
+    def test_redis_nodes(self):
+        store = ShardedStore([("localhost:6379/1", RedisStore(db=1)), ("localhost:6379/2", RedisStore(db=2))])
+        keys = ["sharded:%d" % i for i in range(20)]
+        self.assertTrue(store.set_many([(key, key) for key in keys], 60))
+        self.assertEqual(keys, store.get_many(keys))
+        self.assertTrue(0 < len([key for key in keys if RedisStore(db=1).get(key)]) < 20)
+
+
 if __name__ == "__main__":
     unittest.main()